@@ -12,6 +12,7 @@ import os
 import asyncio
 
 from protobuf2openai.app import app  # FastAPI app
+from protobuf2openai.health_interceptor import HealthInterceptor
 
 
 if __name__ == "__main__":
@@ -23,7 +24,7 @@ if __name__ == "__main__":
     except Exception:
         pass
     uvicorn.run(
-        app,
+        HealthInterceptor(app),
         host=os.getenv("HOST", "127.0.0.1"),
         port=int(os.getenv("PORT", "8010")),
         log_level="info",
@@ -9,8 +9,9 @@ from fastapi import FastAPI
 from .logging import logger
 
 from .config import BRIDGE_BASE_URL, WARMUP_INIT_RETRIES, WARMUP_INIT_DELAY_S
-from .bridge import initialize_once
+from .bridge import close_shared_client, get_shared_client, initialize_once_async
 from .router import router
+from .state import save_state
 
 
 app = FastAPI(title="OpenAI Chat Completions (Warp bridge) - Streaming")
@@ -25,25 +26,41 @@ async def _on_startup():
     except Exception:
         pass
 
+    # Shared keep-alive pool for all bridge calls; closed in _on_shutdown.
+    app.state.bridge_client = get_shared_client()
+
     url = f"{BRIDGE_BASE_URL}/healthz"
     retries = WARMUP_INIT_RETRIES
-    delay_s = WARMUP_INIT_DELAY_S
-    for attempt in range(1, retries + 1):
-        try:
-            async with httpx.AsyncClient(timeout=5.0, trust_env=True) as client:
+    # A local bridge answers in microseconds once up, so poll it tightly
+    # instead of sleeping the full configured interval between probes.
+    delay_s = 0.05 if ("127.0.0.1" in BRIDGE_BASE_URL or "localhost" in BRIDGE_BASE_URL) else WARMUP_INIT_DELAY_S
+    async with httpx.AsyncClient(timeout=5.0, trust_env=True) as client:
+        for attempt in range(1, retries + 1):
+            try:
                 resp = await client.get(url)
-            if resp.status_code == 200:
-                logger.info("[OpenAI Compat] Bridge server is ready at %s", url)
-                break
-            else:
-                logger.warning("[OpenAI Compat] Bridge health at %s -> HTTP %s", url, resp.status_code)
+                if resp.status_code == 200:
+                    logger.info("[OpenAI Compat] Bridge server is ready at %s", url)
+                    break
+                else:
+                    logger.warning("[OpenAI Compat] Bridge health at %s -> HTTP %s", url, resp.status_code)
+            except Exception as e:
+                logger.warning("[OpenAI Compat] Bridge health attempt %s/%s failed: %s", attempt, retries, e)
+            await asyncio.sleep(delay_s)
+        else:
+            logger.error("[OpenAI Compat] Bridge server not ready at %s", url)
+
+    async def _warmup() -> None:
+        try:
+            await initialize_once_async()
         except Exception as e:
-            logger.warning("[OpenAI Compat] Bridge health attempt %s/%s failed: %s", attempt, retries, e)
-        await asyncio.sleep(delay_s)
-    else:
-        logger.error("[OpenAI Compat] Bridge server not ready at %s", url)
+            logger.warning(f"[OpenAI Compat] Warmup initialize_once on startup failed: {e}")
 
-    try:
-        await asyncio.to_thread(initialize_once)
-    except Exception as e:
-        logger.warning(f"[OpenAI Compat] Warmup initialize_once on startup failed: {e}") 
\ No newline at end of file
+    # Run warmup in the background so startup does not block on bridge retries;
+    # requests gate on the warmup event via ensure_initialized().
+    app.state.warmup_task = asyncio.create_task(_warmup())
+
+
+@app.on_event("shutdown")
+async def _on_shutdown():
+    save_state()
+    await close_shared_client() 
\ No newline at end of file
@@ -1,12 +1,16 @@
 from __future__ import annotations
 
+import asyncio
 import json
+import socket
+import random
 import time
 import uuid
 from typing import Any, Dict, Optional
 
-import requests
-from .logging import logger
+import httpx
+from .fastjson import dumps as _json_dumps, dumps_bytes as _json_dumps_bytes
+from .logging import LazyStr, logger
 
 from .config import (
     BRIDGE_BASE_URL,
@@ -17,22 +21,112 @@ from .config import (
     WARMUP_REQUEST_DELAY_S,
 )
 from .packets import packet_template
-from .state import STATE, ensure_tool_ids
+from .state import STATE, ensure_tool_ids, save_state
 
 
-def bridge_send_stream(packet: Dict[str, Any]) -> Dict[str, Any]:
+# Last-known-good liveness per bridge base URL: base -> monotonic expiry.
+# The expiry is smudged with jitter so workers don't re-probe in lockstep.
+_HEALTH_CACHE: Dict[str, float] = {}
+
+
+def _bridge_alive(base: str) -> bool:
+    return _HEALTH_CACHE.get(base, 0.0) > time.monotonic()
+
+
+def _mark_bridge_alive(base: str) -> None:
+    _HEALTH_CACHE[base] = time.monotonic() + 5.0 + random.uniform(-0.5, 0.5)
+
+
+def _backoff(attempt: int, base: float = WARMUP_REQUEST_DELAY_S, cap: float = 30.0) -> float:
+    """Exponential backoff with +/-50% jitter to avoid retry storms against the bridge."""
+    return min(cap, base * (2 ** attempt)) * (1 + random.uniform(-0.5, 0.5))
+
+
+_JSON_HEADERS = {"content-type": "application/json"}
+
+# Small SSE/JSON frames must not sit in the kernel waiting for an ACK to
+# coalesce; disable Nagle on every bridge connection.
+_NODELAY = [(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)]
+
+_shared_client: Optional[httpx.AsyncClient] = None
+
+
+def get_shared_client() -> httpx.AsyncClient:
+    """Return the process-wide AsyncClient for bridge calls, creating it on first use.
+
+    Keep-alive connections are reused across requests, so callers must not close
+    the returned client; lifecycle is owned by the FastAPI startup/shutdown hooks.
+    """
+    global _shared_client
+    if _shared_client is None:
+        _shared_client = httpx.AsyncClient(
+            transport=httpx.AsyncHTTPTransport(
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+                socket_options=_NODELAY,
+            ),
+            timeout=httpx.Timeout(5.0, read=180.0),
+            trust_env=True,
+        )
+    return _shared_client
+
+
+_stream_client: Optional[httpx.AsyncClient] = None
+
+
+def get_stream_client() -> httpx.AsyncClient:
+    """Shared AsyncClient for the SSE streaming path.
+
+    Separate from the JSON client so long-lived streams can't starve the
+    short-request pool; reusing it across requests keeps the TCP/TLS (and
+    HTTP/2) handshake out of the per-stream first-byte latency.
+    """
+    global _stream_client
+    if _stream_client is None:
+        # HTTP/2 over loopback only adds HPACK/framing CPU; keep-alive
+        # HTTP/1.1 is faster against the local bridge. Negotiate H2 only
+        # when the bridge is actually remote.
+        local = BRIDGE_BASE_URL.startswith(("http://127.", "http://localhost"))
+        _stream_client = httpx.AsyncClient(
+            transport=httpx.AsyncHTTPTransport(
+                http2=not local,
+                limits=httpx.Limits(max_keepalive_connections=64, keepalive_expiry=60),
+                socket_options=_NODELAY,
+            ),
+            timeout=httpx.Timeout(60.0),
+            trust_env=True,
+        )
+    return _stream_client
+
+
+async def close_shared_client() -> None:
+    """Close both process-wide clients; called from app shutdown."""
+    global _shared_client, _stream_client
+    if _shared_client is not None:
+        try:
+            await _shared_client.aclose()
+        finally:
+            _shared_client = None
+    if _stream_client is not None:
+        try:
+            await _stream_client.aclose()
+        finally:
+            _stream_client = None
+
+
+async def bridge_send_stream(packet: Dict[str, Any]) -> Dict[str, Any]:
+    client = get_shared_client()
     last_exc: Optional[Exception] = None
     for base in FALLBACK_BRIDGE_URLS:
         url = f"{base}/api/warp/send_stream"
         try:
             wrapped_packet = {"json_data": packet, "message_type": "warp.multi_agent.v1.Request"}
-            try:
-                logger.info("[OpenAI Compat] Bridge request URL: %s", url)
-                logger.info("[OpenAI Compat] Bridge request payload: %s", json.dumps(wrapped_packet, ensure_ascii=False))
-            except Exception:
-                logger.info("[OpenAI Compat] Bridge request payload serialization failed for URL %s", url)
-            r = requests.post(url, json=wrapped_packet, timeout=(5.0, 180.0))
+            body = _json_dumps_bytes(wrapped_packet)
+            logger.info("[OpenAI Compat] Bridge request URL: %s", url)
+            logger.info("[OpenAI Compat] Bridge request payload: %s",
+                        LazyStr(lambda: body.decode("utf-8")))
+            r = await client.post(url, content=body, headers=_JSON_HEADERS)
             if r.status_code == 200:
+                _mark_bridge_alive(base)
                 try:
                     logger.info("[OpenAI Compat] Bridge response (raw text): %s", r.text)
                 except Exception:
@@ -49,7 +143,36 @@ def bridge_send_stream(packet: Dict[str, Any]) -> Dict[str, Any]:
     raise Exception("bridge_unreachable")
 
 
-def initialize_once() -> None:
+# Kept under the historical name for async callers predating the sync removal.
+bridge_send_stream_async = bridge_send_stream
+
+
+# Warmup gate: set once the warmup has succeeded, so request handlers
+# await an event instead of racing their own warmups.
+_INIT_EVENT = asyncio.Event()
+_INIT_LOCK = asyncio.Lock()
+
+
+async def initialize_once_async() -> None:
+    """Single-flight async warmup; only one coroutine runs the warmup,
+    concurrent callers wait on the lock and return once the event is set."""
+    if _INIT_EVENT.is_set():
+        return
+    async with _INIT_LOCK:
+        if _INIT_EVENT.is_set():
+            return
+        await _initialize_once()
+        _INIT_EVENT.set()
+
+
+async def ensure_initialized(timeout: float = 30.0) -> None:
+    """Await warmup completion, kicking it off if it has not run yet."""
+    if _INIT_EVENT.is_set():
+        return
+    await asyncio.wait_for(initialize_once_async(), timeout)
+
+
+async def _initialize_once() -> None:
     if STATE.conversation_id:
         return
 
@@ -58,29 +181,34 @@ def initialize_once() -> None:
     first_task_id = STATE.baseline_task_id or str(uuid.uuid4())
     STATE.baseline_task_id = first_task_id
 
-    health_urls = [f"{base}/healthz" for base in FALLBACK_BRIDGE_URLS]
-    last_err: Optional[str] = None
-    for _ in range(WARMUP_INIT_RETRIES):
-        try:
-            ok = False
-            last_err = None
-            for h in health_urls:
-                try:
-                    resp = requests.get(h, timeout=5.0)
-                    if resp.status_code == 200:
-                        ok = True
-                        break
-                    else:
-                        last_err = f"HTTP {resp.status_code} at {h}"
-                except Exception as he:
-                    last_err = f"{type(he).__name__}: {he} at {h}"
-            if ok:
-                break
-        except Exception as e:
-            last_err = str(e)
-        time.sleep(WARMUP_INIT_DELAY_S)
-    else:
-        raise RuntimeError(f"Bridge server not ready: {last_err}")
+    client = get_shared_client()
+
+    # Skip the probe loop entirely while a recent call has proven the bridge up.
+    if not any(_bridge_alive(base) for base in FALLBACK_BRIDGE_URLS):
+        last_err: Optional[str] = None
+        for attempt_index in range(WARMUP_INIT_RETRIES):
+            try:
+                ok = False
+                last_err = None
+                for base in FALLBACK_BRIDGE_URLS:
+                    h = f"{base}/healthz"
+                    try:
+                        resp = await client.get(h, timeout=5.0)
+                        if resp.status_code == 200:
+                            _mark_bridge_alive(base)
+                            ok = True
+                            break
+                        else:
+                            last_err = f"HTTP {resp.status_code} at {h}"
+                    except Exception as he:
+                        last_err = f"{type(he).__name__}: {he} at {h}"
+                if ok:
+                    break
+            except Exception as e:
+                last_err = str(e)
+            await asyncio.sleep(_backoff(attempt_index, base=WARMUP_INIT_DELAY_S))
+        else:
+            raise RuntimeError(f"Bridge server not ready: {last_err}")
 
     pkt = packet_template()
     pkt["task_context"]["active_task_id"] = first_task_id
@@ -89,17 +217,40 @@ def initialize_once() -> None:
     last_exc: Optional[Exception] = None
     for attempt in range(1, WARMUP_REQUEST_RETRIES + 1):
         try:
-            resp = bridge_send_stream(pkt)
+            resp = await bridge_send_stream(pkt)
             break
         except Exception as e:
             last_exc = e
             logger.warning(f"[OpenAI Compat] Warmup attempt {attempt}/{WARMUP_REQUEST_RETRIES} failed: {e}")
             if attempt < WARMUP_REQUEST_RETRIES:
-                time.sleep(WARMUP_REQUEST_DELAY_S)
+                await asyncio.sleep(_backoff(attempt))
             else:
                 raise
 
     STATE.conversation_id = resp.get("conversation_id") or STATE.conversation_id
     ret_task_id = resp.get("task_id")
     if isinstance(ret_task_id, str) and ret_task_id:
-        STATE.baseline_task_id = ret_task_id 
\ No newline at end of file
+        STATE.baseline_task_id = ret_task_id
+
+    # Representative-shape warmup: prime bridge- and model-side caches with a
+    # packet that looks like production traffic (system prompt + tool list)
+    # instead of only the bare "warmup" query. Best-effort.
+    try:
+        pkt2 = packet_template()
+        pkt2["task_context"]["active_task_id"] = STATE.baseline_task_id or first_task_id
+        pkt2["mcp_context"] = {"tools": [{
+            "name": "warmup_noop",
+            "description": "warmup placeholder tool",
+            "input_schema": {"type": "object", "properties": {}},
+        }]}
+        pkt2["input"]["user_inputs"]["inputs"].append({"user_query": {
+            "query": "warmup",
+            "referenced_attachments": {"SYSTEM_PROMPT": {"plain_text": "You are a helpful assistant."}},
+        }})
+        if STATE.conversation_id:
+            pkt2.setdefault("metadata", {})["conversation_id"] = STATE.conversation_id
+        await bridge_send_stream(pkt2)
+    except Exception as e:
+        logger.warning(f"[OpenAI Compat] Representative warmup skipped: {e}")
+
+    save_state()
@@ -3,52 +3,87 @@ from __future__ import annotations
 from typing import Any, Dict, List
 
 
+_SENTINEL = object()
+
+
 def _get(d: Dict[str, Any], *names: str) -> Any:
+    if not isinstance(d, dict):
+        return None
+    get = d.get
     for n in names:
-        if isinstance(d, dict) and n in d:
-            return d[n]
+        v = get(n, _SENTINEL)
+        if v is not _SENTINEL:
+            return v
     return None
 
 
 def normalize_content_to_list(content: Any) -> List[Dict[str, Any]]:
+    if isinstance(content, str):
+        return [{"type": "text", "text": content}]
     segments: List[Dict[str, Any]] = []
     try:
-        if isinstance(content, str):
-            return [{"type": "text", "text": content}]
         if isinstance(content, list):
             for item in content:
-                if isinstance(item, dict):
-                    t = item.get("type") or ("text" if isinstance(item.get("text"), str) else None)
-                    if t == "text" and isinstance(item.get("text"), str):
-                        segments.append({"type": "text", "text": item.get("text")})
-                    else:
-                        seg: Dict[str, Any] = {}
-                        if t:
-                            seg["type"] = t
-                        if isinstance(item.get("text"), str):
-                            seg["text"] = item.get("text")
-                        if seg:
-                            segments.append(seg)
+                if not isinstance(item, dict):
+                    continue
+                txt = item.get("text")
+                txt_is_str = isinstance(txt, str)
+                t = item.get("type") or ("text" if txt_is_str else None)
+                if t == "text" and txt_is_str:
+                    segments.append({"type": "text", "text": txt})
+                else:
+                    seg: Dict[str, Any] = {}
+                    if t:
+                        seg["type"] = t
+                    if txt_is_str:
+                        seg["text"] = txt
+                    if seg:
+                        segments.append(seg)
             return segments
         if isinstance(content, dict):
-            if isinstance(content.get("text"), str):
-                return [{"type": "text", "text": content.get("text")}]
+            txt = content.get("text")
+            if isinstance(txt, str):
+                return [{"type": "text", "text": txt}]
     except Exception:
         return []
     return []
 
 
+def content_to_text(content: Any) -> str:
+    """Fused normalize + join for callers that only need the text; avoids
+    materializing the intermediate segment list."""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        parts: List[str] = []
+        for item in content:
+            if isinstance(item, dict):
+                txt = item.get("text")
+                if isinstance(txt, str) and (item.get("type") or "text") == "text":
+                    parts.append(txt)
+        return "".join(parts)
+    if isinstance(content, dict):
+        txt = content.get("text")
+        if isinstance(txt, str):
+            return txt
+    return ""
+
+
 def segments_to_text(segments: List[Dict[str, Any]]) -> str:
     parts: List[str] = []
     for seg in segments:
-        if isinstance(seg, dict) and seg.get("type") == "text" and isinstance(seg.get("text"), str):
-            parts.append(seg.get("text") or "")
+        if isinstance(seg, dict) and seg.get("type") == "text":
+            txt = seg.get("text")
+            if isinstance(txt, str):
+                parts.append(txt)
     return "".join(parts)
 
 
 def segments_to_warp_results(segments: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     results: List[Dict[str, Any]] = []
     for seg in segments:
-        if isinstance(seg, dict) and seg.get("type") == "text" and isinstance(seg.get("text"), str):
-            results.append({"text": {"text": seg.get("text")}})
-    return results 
\ No newline at end of file
+        if isinstance(seg, dict) and seg.get("type") == "text":
+            txt = seg.get("text")
+            if isinstance(txt, str):
+                results.append({"text": {"text": txt}})
+    return results
@@ -3,13 +3,20 @@
 """
 Local logging for protobuf2openai package to avoid cross-package dependencies.
 """
+import atexit
 import logging
-from logging.handlers import RotatingFileHandler
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
 
 LOG_DIR = Path("logs")
 LOG_DIR.mkdir(exist_ok=True)
 
+# Skip per-record process/thread introspection and never raise from emit
+logging.logProcesses = False
+logging.logThreads = False
+logging.raiseExceptions = False
+
 _logger = logging.getLogger("protobuf2openai")
 _logger.setLevel(logging.INFO)
 
@@ -26,7 +33,29 @@ fmt = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(funcName)s:%
 file_handler.setFormatter(fmt)
 console_handler.setFormatter(fmt)
 
-_logger.addHandler(file_handler)
-_logger.addHandler(console_handler)
+# Handlers do synchronous file/console I/O; route records through a queue so
+# emit from async handlers is just a queue put and the real I/O happens on a
+# dedicated listener thread.
+_log_queue: queue.SimpleQueue = queue.SimpleQueue()
+_logger.addHandler(QueueHandler(_log_queue))
+
+_listener = QueueListener(_log_queue, file_handler, console_handler, respect_handler_level=True)
+_listener.start()
+atexit.register(_listener.stop)
+
+logger = _logger
+
+
+class LazyStr:
+    """Defer an expensive log argument (e.g. json.dumps of a packet) until a
+    handler actually renders the record; a no-op when the record is filtered."""
+    __slots__ = ("_fn",)
+
+    def __init__(self, fn):
+        self._fn = fn
 
-logger = _logger 
\ No newline at end of file
+    def __str__(self) -> str:
+        try:
+            return self._fn()
+        except Exception:
+            return "<unserializable>" 
\ No newline at end of file
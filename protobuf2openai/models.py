@@ -1,10 +1,12 @@
 from __future__ import annotations
 
 from typing import Any, Dict, List, Optional, Union
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 
 
 class ChatMessage(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
     role: str
     content: Optional[Union[str, List[Dict[str, Any]]]] = ""
     tool_call_id: Optional[str] = None
@@ -24,6 +26,8 @@ class OpenAITool(BaseModel):
 
 
 class ChatCompletionsRequest(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
     model: Optional[str] = None
     messages: List[ChatMessage]
     stream: Optional[bool] = False
@@ -1,94 +1,143 @@
 from __future__ import annotations
 
-import uuid
+import copy
+from functools import lru_cache
+from secrets import token_hex
 from typing import Any, Dict, List, Optional
 import json
 
+from .fastjson import loads as _json_loads
 from .state import STATE, ensure_tool_ids
-from .helpers import normalize_content_to_list, segments_to_text, segments_to_warp_results
+from .helpers import content_to_text, normalize_content_to_list, segments_to_warp_results
 from .models import ChatMessage
 
 
-def packet_template() -> Dict[str, Any]:
-    return {
-        "task_context": {"active_task_id": ""},
-        "input": {"context": {}, "user_inputs": {"inputs": []}},
-        "settings": {
-            "model_config": {
-                "base": "claude-4.1-opus",
-                "planning": "gpt-5 (high reasoning)",
-                "coding": "auto",
-            },
-            "rules_enabled": False,
-            "web_context_retrieval_enabled": False,
-            "supports_parallel_tool_calls": False,
-            "planning_enabled": False,
-            "warp_drive_context_enabled": False,
-            "supports_create_files": False,
-            "use_anthropic_text_editor_tools": False,
-            "supports_long_running_commands": False,
-            "should_preserve_file_content_in_history": False,
-            "supports_todos_ui": False,
-            "supports_linked_code_blocks": False,
-            "supported_tools": [9],
+# Serialized once at import; json.loads is C-implemented, so rehydrating the
+# template is cheaper than rebuilding the nested literals per request and
+# still yields a fresh, independently mutable tree.
+_TEMPLATE_JSON = json.dumps({
+    "task_context": {"active_task_id": ""},
+    "input": {"context": {}, "user_inputs": {"inputs": []}},
+    "settings": {
+        "model_config": {
+            "base": "claude-4.1-opus",
+            "planning": "gpt-5 (high reasoning)",
+            "coding": "auto",
         },
-        "metadata": {"logging": {"is_autodetected_user_query": True, "entrypoint": "USER_INITIATED"}},
-    }
+        "rules_enabled": False,
+        "web_context_retrieval_enabled": False,
+        "supports_parallel_tool_calls": False,
+        "planning_enabled": False,
+        "warp_drive_context_enabled": False,
+        "supports_create_files": False,
+        "use_anthropic_text_editor_tools": False,
+        "supports_long_running_commands": False,
+        "should_preserve_file_content_in_history": False,
+        "supports_todos_ui": False,
+        "supports_linked_code_blocks": False,
+        "supported_tools": [9],
+    },
+    "metadata": {"logging": {"is_autodetected_user_query": True, "entrypoint": "USER_INITIATED"}},
+})
+
+
+# Static prefix for the system-prompt attachment; built once per process.
+_SYSTEM_PROMPT_ALERT_PREFIX = """<ALERT>you are not allowed to call following tools:  - `read_files`
+- `write_files`
+- `run_commands`
+- `list_files`
+- `str_replace_editor`
+- `ask_followup_question`
+- `attempt_completion`</ALERT>"""
+
+
+def packet_template() -> Dict[str, Any]:
+    return _json_loads(_TEMPLATE_JSON)
+
 
+@lru_cache(maxsize=512)
+def _parse_args_cached(arguments: str) -> Any:
+    """Parse a tool_call arguments string once per distinct value; history is
+    replayed every turn, so the same strings recur across a conversation."""
+    return _json_loads(arguments)
 
-def map_history_to_warp_messages(history: List[ChatMessage], task_id: str, system_prompt_for_last_user: Optional[str] = None, attach_to_history_last_user: bool = False) -> List[Dict[str, Any]]:
+
+def _tool_call_args(fn: Dict[str, Any]) -> Any:
+    raw = fn.get("arguments")
+    if isinstance(raw, str):
+        parsed = _parse_args_cached(raw or "{}")
+        # Deep-copy cached containers: a shallow copy leaves nested
+        # lists/dicts aliased to the lru_cache entry, so one packet
+        # mutating them would poison every later hit on the same
+        # arguments string.
+        return copy.deepcopy(parsed) if isinstance(parsed, (dict, list)) else parsed
+    return fn.get("arguments", {})
+
+
+def map_history_to_warp_messages(history: List[ChatMessage], task_id: str, system_prompt_for_last_user: Optional[str] = None, attach_to_history_last_user: bool = False, last_input_index: Optional[int] = None) -> List[Dict[str, Any]]:
     ensure_tool_ids()
-    msgs: List[Dict[str, Any]] = []
+    # Preallocate to the worst-case size (preamble + one entry per message
+    # plus one per assistant tool_call) and assign by index; the list is
+    # trimmed once at the end instead of growing through repeated appends.
+    capacity = 1 + sum(
+        1 + (len(m.tool_calls) if m.role == "assistant" and m.tool_calls else 0)
+        for m in history
+    )
+    msgs: List[Dict[str, Any]] = [None] * capacity  # type: ignore[list-item]
+    k = 0
     # Insert server tool_call preamble as first message
-    msgs.append({
-        "id": (STATE.tool_message_id or str(uuid.uuid4())),
+    msgs[k] = {
+        "id": (STATE.tool_message_id or token_hex(16)),
         "task_id": task_id,
         "tool_call": {
-            "tool_call_id": (STATE.tool_call_id or str(uuid.uuid4())),
+            "tool_call_id": (STATE.tool_call_id or token_hex(16)),
             "server": {"payload": "IgIQAQ=="},
         },
-    })
-
-    # Determine the last input message index (either last 'user' or last 'tool' with tool_call_id)
-    last_input_index: Optional[int] = None
-    for idx in range(len(history) - 1, -1, -1):
-        _m = history[idx]
-        if _m.role == "user":
-            last_input_index = idx
-            break
-        if _m.role == "tool" and _m.tool_call_id:
-            last_input_index = idx
-            break
+    }
+    k += 1
+
+    # Last input message index (last 'user' or last 'tool' with tool_call_id);
+    # normally precomputed by reorder_messages_for_anthropic and passed in.
+    if last_input_index is None:
+        for ridx, _m in enumerate(reversed(history)):
+            if _m.role == "user" or (_m.role == "tool" and _m.tool_call_id):
+                last_input_index = len(history) - 1 - ridx
+                break
 
+    # One batch of random ids up front instead of a urandom read per message
+    ids = [token_hex(16) for _ in range(len(history))]
     for i, m in enumerate(history):
-        mid = str(uuid.uuid4())
+        mid = ids[i]
         # Skip the final input message; it will be placed into input.user_inputs
         if (last_input_index is not None) and (i == last_input_index):
             continue
         if m.role == "user":
-            user_query_obj: Dict[str, Any] = {"query": segments_to_text(normalize_content_to_list(m.content))}
-            msgs.append({"id": mid, "task_id": task_id, "user_query": user_query_obj})
+            user_query_obj: Dict[str, Any] = {"query": content_to_text(m.content)}
+            msgs[k] = {"id": mid, "task_id": task_id, "user_query": user_query_obj}
+            k += 1
         elif m.role == "assistant":
-            _assistant_text = segments_to_text(normalize_content_to_list(m.content))
+            _assistant_text = content_to_text(m.content)
             if _assistant_text:
-                msgs.append({"id": mid, "task_id": task_id, "agent_output": {"text": _assistant_text}})
+                msgs[k] = {"id": mid, "task_id": task_id, "agent_output": {"text": _assistant_text}}
+                k += 1
             for tc in (m.tool_calls or []):
-                msgs.append({
-                    "id": str(uuid.uuid4()),
+                msgs[k] = {
+                    "id": token_hex(16),
                     "task_id": task_id,
                     "tool_call": {
-                        "tool_call_id": tc.get("id") or str(uuid.uuid4()),
+                        "tool_call_id": tc.get("id") or token_hex(16),
                         "call_mcp_tool": {
                             "name": (tc.get("function", {}) or {}).get("name", ""),
-                            "args": (json.loads((tc.get("function", {}) or {}).get("arguments", "{}")) if isinstance((tc.get("function", {}) or {}).get("arguments"), str) else (tc.get("function", {}) or {}).get("arguments", {})) or {},
+                            "args": _tool_call_args(tc.get("function", {}) or {}) or {},
                         },
                     },
-                })
+                }
+                k += 1
         elif m.role == "tool":
             # Preserve tool_result adjacency by placing it directly in task_context
             if m.tool_call_id:
-                msgs.append({
-                    "id": str(uuid.uuid4()),
+                msgs[k] = {
+                    "id": token_hex(16),
                     "task_id": task_id,
                     "tool_call_result": {
                         "tool_call_id": m.tool_call_id,
@@ -98,7 +147,9 @@ def map_history_to_warp_messages(history: List[ChatMessage], task_id: str, syste
                             }
                         },
                     },
-                })
+                }
+                k += 1
+    del msgs[k:]
     return msgs
 
 
@@ -108,17 +159,11 @@ def attach_user_and_tools_to_inputs(packet: Dict[str, Any], history: List[ChatMe
         assert False, "post-reorder 必须至少包含一条消息"
     last = history[-1]
     if last.role == "user":
-        user_query_payload: Dict[str, Any] = {"query": segments_to_text(normalize_content_to_list(last.content))}
+        user_query_payload: Dict[str, Any] = {"query": content_to_text(last.content)}
         if system_prompt_text:
             user_query_payload["referenced_attachments"] = {
                 "SYSTEM_PROMPT": {
-                    "plain_text": f"""<ALERT>you are not allowed to call following tools:  - `read_files`
-- `write_files`
-- `run_commands`
-- `list_files`
-- `str_replace_editor`
-- `ask_followup_question`
-- `attempt_completion`</ALERT>{system_prompt_text}"""
+                    "plain_text": _SYSTEM_PROMPT_ALERT_PREFIX + system_prompt_text
                     }
                 }
         packet["input"]["user_inputs"]["inputs"].append({"user_query": user_query_payload})
@@ -1,13 +1,16 @@
 from __future__ import annotations
 
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 from .models import ChatMessage
 from .helpers import normalize_content_to_list, segments_to_text
 
 
-def reorder_messages_for_anthropic(history: List[ChatMessage]) -> List[ChatMessage]:
+def reorder_messages_for_anthropic(history: List[ChatMessage]) -> Tuple[List[ChatMessage], Optional[int]]:
+    """Reorder history and return it with the index of the final input message
+    (last 'user', or last 'tool' carrying a tool_call_id), computed once here
+    so downstream mappers don't rescan the tail."""
     if not history:
-        return []
+        return [], None
 
     expanded: List[ChatMessage] = []
     for m in history:
@@ -93,4 +96,10 @@ def reorder_messages_for_anthropic(history: List[ChatMessage]) -> List[ChatMessa
         if tr is not None:
             result.append(tr)
 
-    return result 
\ No newline at end of file
+    last_input_index: Optional[int] = None
+    for ridx, _m in enumerate(reversed(result)):
+        if _m.role == "user" or (_m.role == "tool" and _m.tool_call_id):
+            last_input_index = len(result) - 1 - ridx
+            break
+
+    return result, last_input_index 
\ No newline at end of file
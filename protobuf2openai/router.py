@@ -6,19 +6,22 @@ import time
 import uuid
 from typing import Any, Dict, List, Optional
 
+import httpx
 import requests
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
 
-from .logging import logger
+from .fastjson import dumps as _json_dumps
+from .logging import LazyStr, logger
 
 from .models import ChatCompletionsRequest, ChatMessage
 from .reorder import reorder_messages_for_anthropic
-from .helpers import normalize_content_to_list, segments_to_text
+from .helpers import _get, content_to_text
 from .packets import packet_template, map_history_to_warp_messages, attach_user_and_tools_to_inputs
 from .state import STATE
 from .config import BRIDGE_BASE_URL
-from .bridge import initialize_once
+from .bridge import ensure_initialized, get_shared_client
 from .sse_transform import stream_openai_sse
 
 
@@ -54,39 +57,55 @@ def list_models():
 
 
 @router.post("/v1/chat/completions")
-async def chat_completions(req: ChatCompletionsRequest):
+async def chat_completions(request: Request):
+    # Validate straight from the raw body: one C-accelerated pass in
+    # pydantic-core instead of Starlette's JSON decode + a second
+    # per-message model construction.
+    raw_body = await request.body()
     try:
-        initialize_once()
+        req = ChatCompletionsRequest.model_validate_json(raw_body)
+    except ValidationError as ve:
+        # include_input=False: for a non-JSON body the json_invalid error
+        # carries the raw bytes under "input", which JSONResponse cannot
+        # serialize — the 422 would turn into a 500.
+        raise HTTPException(422, ve.errors(include_url=False, include_input=False))
+
+    try:
+        await ensure_initialized()
     except Exception as e:
         logger.warning(f"[OpenAI Compat] initialize_once failed or skipped: {e}")
 
     if not req.messages:
         raise HTTPException(400, "messages 不能为空")
 
+    # 单次 model_dump，两条日志复用（仅在日志真正输出时才执行）
+    _req_dict: Dict[str, Any] = {}
+
+    def _dumped_req() -> Dict[str, Any]:
+        if not _req_dict:
+            _req_dict.update(req.model_dump())
+        return _req_dict
+
     # 1) 打印接收到的 Chat Completions 原始请求体
-    try:
-        logger.info("[OpenAI Compat] 接收到的 Chat Completions 请求体(原始): %s", json.dumps(req.dict(), ensure_ascii=False))
-    except Exception:
-        logger.info("[OpenAI Compat] 接收到的 Chat Completions 请求体(原始) 序列化失败")
+    logger.info("[OpenAI Compat] 接收到的 Chat Completions 请求体(原始): %s",
+                LazyStr(lambda: _json_dumps(_dumped_req())))
 
-    # 整理消息
-    history: List[ChatMessage] = reorder_messages_for_anthropic(list(req.messages))
+    # 整理消息（reorder 不会修改入参，无需复制）
+    history, last_input_index = reorder_messages_for_anthropic(req.messages)
 
     # 2) 打印整理后的请求体（post-reorder）
-    try:
-        logger.info("[OpenAI Compat] 整理后的请求体(post-reorder): %s", json.dumps({
-            **req.dict(),
-            "messages": [m.dict() for m in history]
-        }, ensure_ascii=False))
-    except Exception:
-        logger.info("[OpenAI Compat] 整理后的请求体(post-reorder) 序列化失败")
+    logger.info("[OpenAI Compat] 整理后的请求体(post-reorder): %s",
+                LazyStr(lambda: _json_dumps({
+                    **_dumped_req(),
+                    "messages": [m.model_dump() for m in history]
+                })))
 
     system_prompt_text: Optional[str] = None
     try:
         chunks: List[str] = []
         for _m in history:
             if _m.role == "system":
-                _txt = segments_to_text(normalize_content_to_list(_m.content))
+                _txt = content_to_text(_m.content)
                 if _txt.strip():
                     chunks.append(_txt)
         if chunks:
@@ -101,7 +120,7 @@ async def chat_completions(req: ChatCompletionsRequest):
             "id": task_id,
             "description": "",
             "status": {"in_progress": {}},
-            "messages": map_history_to_warp_messages(history, task_id, None, False),
+            "messages": map_history_to_warp_messages(history, task_id, None, False, last_input_index=last_input_index),
         }],
         "active_task_id": task_id,
     }
@@ -128,10 +147,8 @@ async def chat_completions(req: ChatCompletionsRequest):
             packet.setdefault("mcp_context", {}).setdefault("tools", []).extend(mcp_tools)
 
     # 3) 打印转换成 protobuf JSON 的请求体（发送到 bridge 的数据包）
-    try:
-        logger.info("[OpenAI Compat] 转换成 Protobuf JSON 的请求体: %s", json.dumps(packet, ensure_ascii=False))
-    except Exception:
-        logger.info("[OpenAI Compat] 转换成 Protobuf JSON 的请求体 序列化失败")
+    logger.info("[OpenAI Compat] 转换成 Protobuf JSON 的请求体: %s",
+                LazyStr(lambda: _json_dumps(packet)))
 
     created_ts = int(time.time())
     completion_id = str(uuid.uuid4())
@@ -143,22 +160,23 @@ async def chat_completions(req: ChatCompletionsRequest):
                 yield chunk
         return StreamingResponse(_agen(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "Connection": "keep-alive"})
 
-    def _post_once() -> requests.Response:
-        return requests.post(
+    client = get_shared_client()
+
+    async def _post_once() -> httpx.Response:
+        return await client.post(
             f"{BRIDGE_BASE_URL}/api/warp/send_stream",
             json={"json_data": packet, "message_type": "warp.multi_agent.v1.Request"},
-            timeout=(5.0, 180.0),
         )
 
     try:
-        resp = _post_once()
+        resp = await _post_once()
         if resp.status_code == 429:
             try:
-                r = requests.post(f"{BRIDGE_BASE_URL}/api/auth/refresh", timeout=10.0)
+                r = await client.post(f"{BRIDGE_BASE_URL}/api/auth/refresh", timeout=10.0)
                 logger.warning("[OpenAI Compat] Bridge returned 429. Tried JWT refresh -> HTTP %s", getattr(r, 'status_code', 'N/A'))
             except Exception as _e:
                 logger.warning("[OpenAI Compat] JWT refresh attempt failed after 429: %s", _e)
-            resp = _post_once()
+            resp = await _post_once()
         if resp.status_code != 200:
             raise HTTPException(resp.status_code, f"bridge_error: {resp.text}")
         bridge_resp = resp.json()
@@ -178,15 +196,15 @@ async def chat_completions(req: ChatCompletionsRequest):
         parsed_events = bridge_resp.get("parsed_events", []) or []
         for ev in parsed_events:
             evd = ev.get("parsed_data") or ev.get("raw_data") or {}
-            client_actions = evd.get("client_actions") or evd.get("clientActions") or {}
-            actions = client_actions.get("actions") or client_actions.get("Actions") or []
+            client_actions = _get(evd, "client_actions", "clientActions") or {}
+            actions = _get(client_actions, "actions", "Actions") or []
             for action in actions:
-                add_msgs = action.get("add_messages_to_task") or action.get("addMessagesToTask") or {}
+                add_msgs = _get(action, "add_messages_to_task", "addMessagesToTask") or {}
                 if not isinstance(add_msgs, dict):
                     continue
                 for message in add_msgs.get("messages", []) or []:
-                    tc = message.get("tool_call") or message.get("toolCall") or {}
-                    call_mcp = tc.get("call_mcp_tool") or tc.get("callMcpTool") or {}
+                    tc = _get(message, "tool_call", "toolCall") or {}
+                    call_mcp = _get(tc, "call_mcp_tool", "callMcpTool") or {}
                     if isinstance(call_mcp, dict) and call_mcp.get("name"):
                         try:
                             args_obj = call_mcp.get("args", {}) or {}
@@ -1,345 +1,252 @@
 from __future__ import annotations
 
-import json
-import uuid
-from typing import Any, AsyncGenerator, Dict
+import asyncio
+import logging
+from secrets import token_hex
+from typing import Any, AsyncGenerator, Dict, Optional
 
-import httpx
+from .fastjson import dumps_bytes as _dumps_bytes, dumps as _dumps, loads as _loads
 from .logging import logger
 
+from .bridge import get_stream_client
 from .config import BRIDGE_BASE_URL
-from .helpers import _get
 
+# SSE framing constants; frames are yielded as bytes so Starlette's
+# StreamingResponse skips its str->bytes re-encode per chunk.
+_PREFIX = b"data: "
+_SUFFIX = b"\n\n"
+_DONE = b"data: [DONE]\n\n"
+
+# The opening role chunk only varies in id/created/model, so the fixed
+# scaffolding is %-formatted into a prebuilt template instead of being
+# JSON-encoded per request. id and model are substituted as JSON-encoded
+# string literals (quotes included): model comes straight from the client
+# request, so splicing it in raw would break the frame on quotes,
+# backslashes or control characters.
+_FIRST_TMPL = (
+    b'data: {"id":%b,"object":"chat.completion.chunk","created":%d,"model":%b,'
+    b'"choices":[{"index":0,"delta":{"role":"assistant"}}]}\n\n'
+)
+
+
+def _kget(d: Any, snake: str, camel: str, key_cache: Dict[str, str]) -> Any:
+    """dict.get with per-stream snake/camel spelling cache (see stream_openai_sse)."""
+    if not isinstance(d, dict):
+        return None
+    k = key_cache.get(snake)
+    if k is not None:
+        return d.get(k)
+    if snake in d:
+        key_cache[snake] = snake
+        return d[snake]
+    if camel in d:
+        key_cache[snake] = camel
+        return d[camel]
+    return None
+
+
+def _iter_deltas(event_data: Dict[str, Any], key_cache: Dict[str, str]) -> list:
+    """Walk one bridge event and collect the deltas to emit.
+
+    Returns ("text", content) and ("tool", tool_call_id, name, args_str)
+    tuples in emission order, with contiguous text fragments already
+    coalesced. The whole hot dict traversal lives in this one flat function
+    so the generator above it only formats frames — and the walker can be
+    compiled (mypyc) later without touching any async code.
+    """
+    out: list = []
+    client_actions = _kget(event_data, "client_actions", "clientActions", key_cache)
+    if not isinstance(client_actions, dict):
+        return out
+    actions = _kget(client_actions, "actions", "Actions", key_cache) or []
+    # Contiguous text fragments within one bridge event are coalesced into a
+    # single chunk; a tool_call flushes the buffer first to preserve ordering.
+    text_buf: list = []
+    for action in actions:
+        append_data = _kget(action, "append_to_message_content", "appendToMessageContent", key_cache)
+        if isinstance(append_data, dict):
+            message = append_data.get("message", {})
+            agent_output = _kget(message, "agent_output", "agentOutput", key_cache) or {}
+            text_content = agent_output.get("text", "")
+            if text_content:
+                text_buf.append(text_content)
+
+        messages_data = _kget(action, "add_messages_to_task", "addMessagesToTask", key_cache)
+        if isinstance(messages_data, dict):
+            messages = messages_data.get("messages", [])
+            for message in messages:
+                tool_call = _kget(message, "tool_call", "toolCall", key_cache) or {}
+                call_mcp = _kget(tool_call, "call_mcp_tool", "callMcpTool", key_cache) or {}
+                if isinstance(call_mcp, dict) and call_mcp.get("name"):
+                    if text_buf:
+                        out.append(("text", "".join(text_buf)))
+                        text_buf.clear()
+                    # Pass-through MCP tools may deliver args pre-serialized;
+                    # don't re-encode those.
+                    raw_args = call_mcp.get("args")
+                    if isinstance(raw_args, str):
+                        args_str = raw_args
+                    elif not raw_args:
+                        args_str = "{}"
+                    else:
+                        try:
+                            args_str = _dumps(raw_args)
+                        except Exception:
+                            args_str = "{}"
+                    out.append(("tool", tool_call.get("tool_call_id") or token_hex(16), call_mcp.get("name"), args_str))
+                else:
+                    agent_output = _kget(message, "agent_output", "agentOutput", key_cache) or {}
+                    text_content = agent_output.get("text", "")
+                    if text_content:
+                        text_buf.append(text_content)
+    if text_buf:
+        out.append(("text", "".join(text_buf)))
+    return out
+
+
+async def stream_openai_sse(packet: Dict[str, Any], completion_id: str, created_ts: int, model_id: str) -> AsyncGenerator[bytes, None]:
+    # Snapshot once per stream: skips the serialize-for-logging work per event
+    # when INFO is filtered out.
+    _info = logger.isEnabledFor(logging.INFO)
+
+    # Static per-request scaffold shared by every emitted chunk; _frame only
+    # allocates the choice/delta that actually differs per event.
+    base = {"id": completion_id, "object": "chat.completion.chunk", "created": created_ts, "model": model_id}
+
+    # The bridge emits a consistent key case (snake or camel) for the whole
+    # session; remember which spelling matched so later events resolve with a
+    # single dict.get instead of the two-way probe every time.
+    key_cache: Dict[str, str] = {}
+
+    def _frame(delta: Dict[str, Any], finish: Optional[str] = None, label: str = "emit") -> bytes:
+        choice: Dict[str, Any] = {"index": 0, "delta": delta}
+        if finish is not None:
+            choice["finish_reason"] = finish
+        encoded = _dumps_bytes({**base, "choices": [choice]})
+        if _info:
+            logger.info("[OpenAI Compat] 转换后的 SSE(%s): %s", label, encoded.decode("utf-8"))
+        return _PREFIX + encoded + _SUFFIX
+
+    async def _consume(response) -> AsyncGenerator[bytes, None]:
+        """Translate the bridge SSE stream into OpenAI chunk frames.
+
+        Frames are split on the ``b"\\n\\n"`` event terminator out of a
+        bytearray fed by 64 KiB reads; payload bytes go straight into the JSON
+        decoder, skipping aiter_lines' per-line str decode and Python-level
+        line splitting (which hurts on large tool_call/args payloads).
+        """
+        tool_calls_emitted = False
+        buf = bytearray()
+        done = False
+        async for chunk in response.aiter_bytes(65536):
+            buf += chunk
+            while (i := buf.find(b"\n\n")) != -1:
+                block = bytes(buf[:i])
+                del buf[: i + 2]
+                payload = b""
+                for line in block.split(b"\n"):
+                    if line.startswith(b"data:"):
+                        payload += line[5:].strip()
+                if not payload:
+                    continue
+                if _info:
+                    logger.info("[OpenAI Compat] 接收到的 Protobuf SSE(data): %s", payload.decode("utf-8", "replace"))
+                if payload == b"[DONE]":
+                    done = True
+                    break
+                try:
+                    ev = _loads(payload)
+                except Exception:
+                    continue
+                event_data = (ev or {}).get("parsed_data") or {}
+
+                if _info:
+                    logger.info("[OpenAI Compat] 接收到的 Protobuf 事件(parsed): %s", _dumps(event_data))
+
+                for delta in _iter_deltas(event_data, key_cache):
+                    if delta[0] == "text":
+                        yield _frame({"content": delta[1]})
+                    else:
+                        _, tool_call_id, name, args_str = delta
+                        yield _frame({
+                            "tool_calls": [{
+                                "index": 0,
+                                "id": tool_call_id,
+                                "type": "function",
+                                "function": {"name": name, "arguments": args_str},
+                            }]
+                        }, label="emit tool_calls")
+                        tool_calls_emitted = True
+
+                if "finished" in event_data:
+                    yield _frame({}, finish=("tool_calls" if tool_calls_emitted else "stop"), label="emit done")
+            if done:
+                break
+
+        if _info:
+            logger.info("[OpenAI Compat] 转换后的 SSE(emit): [DONE]")
+        yield _DONE
 
-async def stream_openai_sse(packet: Dict[str, Any], completion_id: str, created_ts: int, model_id: str) -> AsyncGenerator[str, None]:
     try:
-        first = {
-            "id": completion_id,
-            "object": "chat.completion.chunk",
-            "created": created_ts,
-            "model": model_id,
-            "choices": [{"index": 0, "delta": {"role": "assistant"}}],
-        }
-        # 打印转换后的首个 SSE 事件（OpenAI 格式）
-        try:
-            logger.info("[OpenAI Compat] 转换后的 SSE(emit): %s", json.dumps(first, ensure_ascii=False))
-        except Exception:
-            pass
-        yield f"data: {json.dumps(first, ensure_ascii=False)}\n\n"
-
-        timeout = httpx.Timeout(60.0)
-        async with httpx.AsyncClient(http2=True, timeout=timeout, trust_env=True) as client:
-            def _do_stream():
-                return client.stream(
-                    "POST",
-                    f"{BRIDGE_BASE_URL}/api/warp/send_stream_sse",
-                    headers={"accept": "text/event-stream"},
-                    json={"json_data": packet, "message_type": "warp.multi_agent.v1.Request"},
-                )
-
-            # 首次请求
-            response_cm = _do_stream()
-            async with response_cm as response:
-                if response.status_code == 429:
-                    try:
-                        r = await client.post(f"{BRIDGE_BASE_URL}/api/auth/refresh", timeout=10.0)
-                        logger.warning("[OpenAI Compat] Bridge returned 429. Tried JWT refresh -> HTTP %s", r.status_code)
-                    except Exception as _e:
-                        logger.warning("[OpenAI Compat] JWT refresh attempt failed after 429: %s", _e)
-                    # 重试一次
-                    response_cm2 = _do_stream()
-                    async with response_cm2 as response2:
-                        response = response2
+        first = _FIRST_TMPL % (_dumps_bytes(completion_id), created_ts, _dumps_bytes(model_id))
+        if _info:
+            logger.info("[OpenAI Compat] 转换后的 SSE(emit): %s", first[6:-2].decode("utf-8"))
+        yield first
+
+        client = get_stream_client()
+
+        def _do_stream():
+            return client.stream(
+                "POST",
+                f"{BRIDGE_BASE_URL}/api/warp/send_stream_sse",
+                headers={"accept": "text/event-stream"},
+                json={"json_data": packet, "message_type": "warp.multi_agent.v1.Request"},
+            )
+
+        # 读取/解析放到独立任务里，与下游写出重叠；有界队列防止快读慢写撑爆内存
+        q: asyncio.Queue = asyncio.Queue(64)
+        reader_exc: list = []
+
+        async def _reader() -> None:
+            try:
+                # 429 触发一次 JWT 刷新并重开连接；解析循环只存在一份
+                for attempt in (1, 2):
+                    async with _do_stream() as response:
+                        if response.status_code == 429 and attempt == 1:
+                            try:
+                                r = await client.post(f"{BRIDGE_BASE_URL}/api/auth/refresh", timeout=10.0)
+                                logger.warning("[OpenAI Compat] Bridge returned 429. Tried JWT refresh -> HTTP %s", r.status_code)
+                            except Exception as _e:
+                                logger.warning("[OpenAI Compat] JWT refresh attempt failed after 429: %s", _e)
+                            continue
                         if response.status_code != 200:
                             error_text = await response.aread()
                             error_content = error_text.decode("utf-8") if error_text else ""
                             logger.error(f"[OpenAI Compat] Bridge HTTP error {response.status_code}: {error_content[:300]}")
                             raise RuntimeError(f"bridge error: {error_content}")
-                        current = ""
-                        tool_calls_emitted = False
-                        async for line in response.aiter_lines():
-                            if line.startswith("data:"):
-                                payload = line[5:].strip()
-                                if not payload:
-                                    continue
-                                # 打印接收到的 Protobuf SSE 原始事件片段
-                                try:
-                                    logger.info("[OpenAI Compat] 接收到的 Protobuf SSE(data): %s", payload)
-                                except Exception:
-                                    pass
-                                if payload == "[DONE]":
-                                    break
-                                current += payload
-                                continue
-                            if (line.strip() == "") and current:
-                                try:
-                                    ev = json.loads(current)
-                                except Exception:
-                                    current = ""
-                                    continue
-                                current = ""
-                                event_data = (ev or {}).get("parsed_data") or {}
-
-                                # 打印接收到的 Protobuf 事件（解析后）
-                                try:
-                                    logger.info("[OpenAI Compat] 接收到的 Protobuf 事件(parsed): %s", json.dumps(event_data, ensure_ascii=False))
-                                except Exception:
-                                    pass
-
-                                if "init" in event_data:
-                                    pass
-
-                                client_actions = _get(event_data, "client_actions", "clientActions")
-                                if isinstance(client_actions, dict):
-                                    actions = _get(client_actions, "actions", "Actions") or []
-                                    for action in actions:
-                                        append_data = _get(action, "append_to_message_content", "appendToMessageContent")
-                                        if isinstance(append_data, dict):
-                                            message = append_data.get("message", {})
-                                            agent_output = _get(message, "agent_output", "agentOutput") or {}
-                                            text_content = agent_output.get("text", "")
-                                            if text_content:
-                                                delta = {
-                                                    "id": completion_id,
-                                                    "object": "chat.completion.chunk",
-                                                    "created": created_ts,
-                                                    "model": model_id,
-                                                    "choices": [{"index": 0, "delta": {"content": text_content}}],
-                                                }
-                                                # 打印转换后的 OpenAI SSE 事件
-                                                try:
-                                                    logger.info("[OpenAI Compat] 转换后的 SSE(emit): %s", json.dumps(delta, ensure_ascii=False))
-                                                except Exception:
-                                                    pass
-                                                yield f"data: {json.dumps(delta, ensure_ascii=False)}\n\n"
-
-                                        messages_data = _get(action, "add_messages_to_task", "addMessagesToTask")
-                                        if isinstance(messages_data, dict):
-                                            messages = messages_data.get("messages", [])
-                                            for message in messages:
-                                                tool_call = _get(message, "tool_call", "toolCall") or {}
-                                                call_mcp = _get(tool_call, "call_mcp_tool", "callMcpTool") or {}
-                                                if isinstance(call_mcp, dict) and call_mcp.get("name"):
-                                                    try:
-                                                        args_obj = call_mcp.get("args", {}) or {}
-                                                        args_str = json.dumps(args_obj, ensure_ascii=False)
-                                                    except Exception:
-                                                        args_str = "{}"
-                                                    tool_call_id = tool_call.get("tool_call_id") or str(uuid.uuid4())
-                                                    delta = {
-                                                        "id": completion_id,
-                                                        "object": "chat.completion.chunk",
-                                                        "created": created_ts,
-                                                        "model": model_id,
-                                                        "choices": [{
-                                                            "index": 0,
-                                                            "delta": {
-                                                                "tool_calls": [{
-                                                                    "index": 0,
-                                                                    "id": tool_call_id,
-                                                                    "type": "function",
-                                                                    "function": {"name": call_mcp.get("name"), "arguments": args_str},
-                                                                }]
-                                                            }
-                                                        }],
-                                                    }
-                                                    # 打印转换后的 OpenAI 工具调用事件
-                                                    try:
-                                                        logger.info("[OpenAI Compat] 转换后的 SSE(emit tool_calls): %s", json.dumps(delta, ensure_ascii=False))
-                                                    except Exception:
-                                                        pass
-                                                    yield f"data: {json.dumps(delta, ensure_ascii=False)}\n\n"
-                                                    tool_calls_emitted = True
-                                                else:
-                                                    agent_output = _get(message, "agent_output", "agentOutput") or {}
-                                                    text_content = agent_output.get("text", "")
-                                                    if text_content:
-                                                        delta = {
-                                                            "id": completion_id,
-                                                            "object": "chat.completion.chunk",
-                                                            "created": created_ts,
-                                                            "model": model_id,
-                                                            "choices": [{"index": 0, "delta": {"content": text_content}}],
-                                                        }
-                                                        try:
-                                                            logger.info("[OpenAI Compat] 转换后的 SSE(emit): %s", json.dumps(delta, ensure_ascii=False))
-                                                        except Exception:
-                                                            pass
-                                                        yield f"data: {json.dumps(delta, ensure_ascii=False)}\n\n"
-
-                                if "finished" in event_data:
-                                    done_chunk = {
-                                        "id": completion_id,
-                                        "object": "chat.completion.chunk",
-                                        "created": created_ts,
-                                        "model": model_id,
-                                        "choices": [{"index": 0, "delta": {}, "finish_reason": ("tool_calls" if tool_calls_emitted else "stop")}],
-                                    }
-                                    try:
-                                        logger.info("[OpenAI Compat] 转换后的 SSE(emit done): %s", json.dumps(done_chunk, ensure_ascii=False))
-                                    except Exception:
-                                        pass
-                                    yield f"data: {json.dumps(done_chunk, ensure_ascii=False)}\n\n"
-
-                        # 打印完成标记
-                        try:
-                            logger.info("[OpenAI Compat] 转换后的 SSE(emit): [DONE]")
-                        except Exception:
-                            pass
-                        yield "data: [DONE]\n\n"
-                        return
-
-                if response.status_code != 200:
-                    error_text = await response.aread()
-                    error_content = error_text.decode("utf-8") if error_text else ""
-                    logger.error(f"[OpenAI Compat] Bridge HTTP error {response.status_code}: {error_content[:300]}")
-                    raise RuntimeError(f"bridge error: {error_content}")
-
-                current = ""
-                tool_calls_emitted = False
-                async for line in response.aiter_lines():
-                    if line.startswith("data:"):
-                        payload = line[5:].strip()
-                        if not payload:
-                            continue
-                        # 打印接收到的 Protobuf SSE 原始事件片段
-                        try:
-                            logger.info("[OpenAI Compat] 接收到的 Protobuf SSE(data): %s", payload)
-                        except Exception:
-                            pass
-                        if payload == "[DONE]":
-                            break
-                        current += payload
-                        continue
-                    if (line.strip() == "") and current:
-                        try:
-                            ev = json.loads(current)
-                        except Exception:
-                            current = ""
-                            continue
-                        current = ""
-                        event_data = (ev or {}).get("parsed_data") or {}
-
-                        # 打印接收到的 Protobuf 事件（解析后）
-                        try:
-                            logger.info("[OpenAI Compat] 接收到的 Protobuf 事件(parsed): %s", json.dumps(event_data, ensure_ascii=False))
-                        except Exception:
-                            pass
-
-                        if "init" in event_data:
-                            pass
-
-                        client_actions = _get(event_data, "client_actions", "clientActions")
-                        if isinstance(client_actions, dict):
-                            actions = _get(client_actions, "actions", "Actions") or []
-                            for action in actions:
-                                append_data = _get(action, "append_to_message_content", "appendToMessageContent")
-                                if isinstance(append_data, dict):
-                                    message = append_data.get("message", {})
-                                    agent_output = _get(message, "agent_output", "agentOutput") or {}
-                                    text_content = agent_output.get("text", "")
-                                    if text_content:
-                                        delta = {
-                                            "id": completion_id,
-                                            "object": "chat.completion.chunk",
-                                            "created": created_ts,
-                                            "model": model_id,
-                                            "choices": [{"index": 0, "delta": {"content": text_content}}],
-                                        }
-                                        # 打印转换后的 OpenAI SSE 事件
-                                        try:
-                                            logger.info("[OpenAI Compat] 转换后的 SSE(emit): %s", json.dumps(delta, ensure_ascii=False))
-                                        except Exception:
-                                            pass
-                                        yield f"data: {json.dumps(delta, ensure_ascii=False)}\n\n"
-
-                                messages_data = _get(action, "add_messages_to_task", "addMessagesToTask")
-                                if isinstance(messages_data, dict):
-                                    messages = messages_data.get("messages", [])
-                                    for message in messages:
-                                        tool_call = _get(message, "tool_call", "toolCall") or {}
-                                        call_mcp = _get(tool_call, "call_mcp_tool", "callMcpTool") or {}
-                                        if isinstance(call_mcp, dict) and call_mcp.get("name"):
-                                            try:
-                                                args_obj = call_mcp.get("args", {}) or {}
-                                                args_str = json.dumps(args_obj, ensure_ascii=False)
-                                            except Exception:
-                                                args_str = "{}"
-                                            tool_call_id = tool_call.get("tool_call_id") or str(uuid.uuid4())
-                                            delta = {
-                                                "id": completion_id,
-                                                "object": "chat.completion.chunk",
-                                                "created": created_ts,
-                                                "model": model_id,
-                                                "choices": [{
-                                                    "index": 0,
-                                                    "delta": {
-                                                        "tool_calls": [{
-                                                            "index": 0,
-                                                            "id": tool_call_id,
-                                                            "type": "function",
-                                                            "function": {"name": call_mcp.get("name"), "arguments": args_str},
-                                                        }]
-                                                    }
-                                                }],
-                                            }
-                                            # 打印转换后的 OpenAI 工具调用事件
-                                            try:
-                                                logger.info("[OpenAI Compat] 转换后的 SSE(emit tool_calls): %s", json.dumps(delta, ensure_ascii=False))
-                                            except Exception:
-                                                pass
-                                            yield f"data: {json.dumps(delta, ensure_ascii=False)}\n\n"
-                                            tool_calls_emitted = True
-                                        else:
-                                            agent_output = _get(message, "agent_output", "agentOutput") or {}
-                                            text_content = agent_output.get("text", "")
-                                            if text_content:
-                                                delta = {
-                                                    "id": completion_id,
-                                                    "object": "chat.completion.chunk",
-                                                    "created": created_ts,
-                                                    "model": model_id,
-                                                    "choices": [{"index": 0, "delta": {"content": text_content}}],
-                                                }
-                                                try:
-                                                    logger.info("[OpenAI Compat] 转换后的 SSE(emit): %s", json.dumps(delta, ensure_ascii=False))
-                                                except Exception:
-                                                    pass
-                                                yield f"data: {json.dumps(delta, ensure_ascii=False)}\n\n"
-
-                        if "finished" in event_data:
-                            done_chunk = {
-                                "id": completion_id,
-                                "object": "chat.completion.chunk",
-                                "created": created_ts,
-                                "model": model_id,
-                                "choices": [{"index": 0, "delta": {}, "finish_reason": ("tool_calls" if tool_calls_emitted else "stop")}],
-                            }
-                            try:
-                                logger.info("[OpenAI Compat] 转换后的 SSE(emit done): %s", json.dumps(done_chunk, ensure_ascii=False))
-                            except Exception:
-                                pass
-                            yield f"data: {json.dumps(done_chunk, ensure_ascii=False)}\n\n"
-
-                # 打印完成标记
-                try:
-                    logger.info("[OpenAI Compat] 转换后的 SSE(emit): [DONE]")
-                except Exception:
-                    pass
-                yield "data: [DONE]\n\n"
+                        async for chunk in _consume(response):
+                            await q.put(chunk)
+                        break
+            except Exception as e:
+                reader_exc.append(e)
+            finally:
+                await q.put(None)
+
+        task = asyncio.create_task(_reader())
+        try:
+            while (item := await q.get()) is not None:
+                yield item
+        finally:
+            # 客户端断开时及时拆掉对 bridge 的连接
+            if not task.done():
+                task.cancel()
+        if reader_exc:
+            raise reader_exc[0]
     except Exception as e:
         logger.error(f"[OpenAI Compat] Stream processing failed: {e}")
-        error_chunk = {
-            "id": completion_id,
-            "object": "chat.completion.chunk",
-            "created": created_ts,
-            "model": model_id,
-            "choices": [{"index": 0, "delta": {}, "finish_reason": "error"}],
-            "error": {"message": str(e)},
-        }
-        try:
-            logger.info("[OpenAI Compat] 转换后的 SSE(emit error): %s", json.dumps(error_chunk, ensure_ascii=False))
-        except Exception:
-            pass
-        yield f"data: {json.dumps(error_chunk, ensure_ascii=False)}\n\n"
-        yield "data: [DONE]\n\n" 
\ No newline at end of file
+        error_chunk = {**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "error"}], "error": {"message": str(e)}}
+        encoded = _dumps_bytes(error_chunk)
+        if _info:
+            logger.info("[OpenAI Compat] 转换后的 SSE(emit error): %s", encoded.decode("utf-8"))
+        yield _PREFIX + encoded + _SUFFIX
+        yield _DONE
@@ -1,23 +1,58 @@
 from __future__ import annotations
 
-import uuid
+import json
+import time
+from dataclasses import asdict, dataclass
+from secrets import token_hex
+from pathlib import Path
 from typing import Optional
-from pydantic import BaseModel
 
+_STATE_FILE = Path("logs") / "state.json"
+_STATE_MAX_AGE_S = 3600.0
+
+
+@dataclass(slots=True)
+class BridgeState:
+    """Mutable 4-field warmup state; a slotted dataclass keeps attribute
+    access plain (no pydantic validation machinery on every write)."""
 
-class BridgeState(BaseModel):
     conversation_id: Optional[str] = None
     baseline_task_id: Optional[str] = None
     tool_call_id: Optional[str] = None
     tool_message_id: Optional[str] = None
 
 
-STATE = BridgeState()
+def _load_persisted_state() -> Optional[BridgeState]:
+    """Rehydrate warmup state from a previous run so restarts skip the
+    cold-start warmup; stale snapshots (>1h) are ignored."""
+    try:
+        raw = json.loads(_STATE_FILE.read_text(encoding="utf-8"))
+        if time.time() - float(raw.get("saved_at", 0)) > _STATE_MAX_AGE_S:
+            return None
+        state = BridgeState(**(raw.get("state") or {}))
+        return state if state.conversation_id else None
+    except Exception:
+        return None
+
+
+def save_state() -> None:
+    """Persist warmup state for the next process; best-effort."""
+    try:
+        _STATE_FILE.parent.mkdir(exist_ok=True)
+        _STATE_FILE.write_text(
+            json.dumps({"saved_at": time.time(), "state": asdict(STATE)}, ensure_ascii=False),
+            encoding="utf-8",
+        )
+    except Exception:
+        pass
+
+
+STATE = _load_persisted_state() or BridgeState()
 
 # Initialize tool ids lazily when needed
 
 def ensure_tool_ids():
     if not STATE.tool_call_id:
-        STATE.tool_call_id = str(uuid.uuid4())
+        STATE.tool_call_id = token_hex(16)
     if not STATE.tool_message_id:
-        STATE.tool_message_id = str(uuid.uuid4()) 
\ No newline at end of file
+        STATE.tool_message_id = token_hex(16)
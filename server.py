@@ -201,8 +201,17 @@ async def lifespan(app: FastAPI):
     # 启动时执行
     await startup_tasks()
     yield
-    # 关闭时执行（如果需要的话）
-    pass
+    # 关闭时执行：释放 auth 模块与 Warp API 客户端的共享 HTTP 客户端
+    try:
+        from warp2protobuf.core.auth import close_http_client
+        await close_http_client()
+    except Exception:
+        pass
+    try:
+        from warp2protobuf.warp.api_client import close_warp_client
+        await close_warp_client()
+    except Exception:
+        pass
 
 
 def create_app() -> FastAPI:
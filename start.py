@@ -1,38 +1,68 @@
 from __future__ import annotations
 import asyncio
+import contextlib
 import os
-import threading
+import signal
 from protobuf2openai.app import app as openai_server  # FastAPI app
+from protobuf2openai.health_interceptor import HealthInterceptor
 from server import create_app, startup_tasks
 import uvicorn
 
 
 async def main():
-    # 在后台线程启动 warp server
+    # 两个服务共用一个事件循环：不再为 warp server 另起线程和第二个 asyncio loop，
+    # 省掉线程间 GIL 争抢；loop="auto" 在装了 uvloop 时自动启用
     warp_app = create_app()
     await startup_tasks()
-    
-    # 启动 warp server 的后台线程
-    warp_thread = threading.Thread(
-        target=uvicorn.run,
-        args=(warp_app,),
-        kwargs={"host": "127.0.0.1", "port": 8000, "log_level": "info", "access_log": True},
-        daemon=True
-    )
-    warp_thread.start()
-    
+
     try:
         from warp2protobuf.core.auth import refresh_jwt_if_needed as _refresh_jwt
         await _refresh_jwt()
     except Exception:
         pass
-    
 
-if __name__ == "__main__":
-    asyncio.run(main())
-    uvicorn.run(
-        openai_server,
+    warp_config = uvicorn.Config(
+        warp_app,
+        host="127.0.0.1",
+        port=8000,
+        log_level="info",
+        access_log=True,
+        loop="auto",
+    )
+    openai_config = uvicorn.Config(
+        HealthInterceptor(openai_server),
         host=os.getenv("HOST", "0.0.0.0"),
         port=int(os.getenv("PORT", "8010")),
         log_level="info",
+        loop="auto",
     )
+    # 不能各自调用 serve():两个 server 的 capture_signals() 都会在主线程
+    # signal.signal(sig, self.handle_exit),后注册的覆盖先注册的,收到
+    # SIGINT/SIGTERM 时只有一个 server 置 should_exit,gather 永远等不到
+    # 另一个退出。改为自己接管信号、一次性通知两个 server,并直接跑
+    # _serve() 绕过各自的信号注册。
+    servers = (uvicorn.Server(warp_config), uvicorn.Server(openai_config))
+    loop = asyncio.get_running_loop()
+
+    def _handle_exit(sig: int) -> None:
+        for server in servers:
+            server.handle_exit(sig, None)
+
+    handled_signals = (signal.SIGINT, signal.SIGTERM)
+    for sig in handled_signals:
+        try:
+            loop.add_signal_handler(sig, _handle_exit, sig)
+        except NotImplementedError:
+            # Windows 的 Proactor loop 不支持 add_signal_handler
+            signal.signal(sig, lambda s, _f: _handle_exit(s))
+
+    try:
+        await asyncio.gather(*(server._serve() for server in servers))
+    finally:
+        for sig in handled_signals:
+            with contextlib.suppress(NotImplementedError, ValueError):
+                loop.remove_signal_handler(sig)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
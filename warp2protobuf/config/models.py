@@ -6,35 +6,39 @@ Model configuration and catalog for Warp API
 Contains model definitions, configurations, and OpenAI compatibility mappings.
 """
 import time
+from types import MappingProxyType
 
+# Known models that map directly; prebuilt so the per-request membership
+# test is a single hash lookup instead of reconstructing the set.
+_KNOWN_MODELS = frozenset({
+    "claude-4-sonnet", "claude-4-opus", "claude-4.1-opus",
+    "gpt-5", "gpt-4o", "gpt-4.1", "o3", "o4-mini",
+    "gemini-2.5-pro", "warp-basic"
+})
 
-def get_model_config(model_name: str) -> dict:
+# All configs follow the same base/o3/auto pattern, so the full table is
+# prebuilt at import; MappingProxyType keeps the shared entries read-only
+# since they are handed to every request.
+_MODEL_CFG_TABLE = {
+    m: MappingProxyType({"base": m, "planning": "o3", "coding": "auto"})
+    for m in _KNOWN_MODELS
+}
+_AUTO_CFG = MappingProxyType({"base": "auto", "planning": "o3", "coding": "auto"})
+
+
+def get_model_config(model_name: str):
     """
     Simple model configuration mapping.
     All models use the same pattern: base model + o3 planning + auto coding
-    """
-    # Known models that map directly
-    known_models = {
-        "claude-4-sonnet", "claude-4-opus", "claude-4.1-opus",
-        "gpt-5", "gpt-4o", "gpt-4.1", "o3", "o4-mini",
-        "gemini-2.5-pro", "warp-basic"
-    }
-
-    model_name = model_name.lower().strip()
-
-    # Use the model name directly if it's known, otherwise use "auto"
-    base_model = model_name if model_name in known_models else "auto"
 
-    return {
-        "base": base_model,
-        "planning": "o3",
-        "coding": "auto"
-    }
+    Returns a read-only view shared across requests; unknown names map to "auto".
+    """
+    return _MODEL_CFG_TABLE.get(model_name.lower().strip(), _AUTO_CFG)
 
 
-def get_warp_models():
-    """Get comprehensive list of Warp AI models from packet analysis"""
-    return {
+# Static catalog from packet analysis; built once at import instead of
+# reallocating the whole nested structure on every call.
+_WARP_MODELS = {
         "agent_mode": {
             "default": "auto",
             "models": [
@@ -285,35 +289,43 @@ def get_warp_models():
     }
 
 
-def get_all_unique_models():
-    """Get all unique models across all categories for OpenAI API compatibility"""
+def get_warp_models():
+    """Get comprehensive list of Warp AI models from packet analysis"""
+    return _WARP_MODELS
+
+
+def _build_unique_models():
+    """Flatten the catalog into OpenAI-compatible entries (runs once at import)."""
     try:
         models_data = get_warp_models()
-        unique_models = {}
+        created = int(time.time())
+        by_id: dict = {}
 
-        # Collect all unique models across categories
+        # Single pass; categories are collected in an insertion-ordered dict
+        # so dedup is a hash lookup instead of a list scan, while keeping the
+        # original category order in the output.
         for category_data in models_data.values():
             for model in category_data["models"]:
-                model_id = model["id"]
-                if model_id not in unique_models:
+                entry = by_id.get(model["id"])
+                if entry is None:
                     # Create OpenAI-compatible model entry
-                    unique_models[model_id] = {
-                        "id": model_id,
+                    by_id[model["id"]] = {
+                        "id": model["id"],
                         "object": "model",
-                        "created": int(time.time()),
+                        "created": created,
                         "owned_by": "warp",
                         "display_name": model["display_name"],
                         "description": model["description"] or model["display_name"],
                         "vision_supported": model["vision_supported"],
                         "usage_multiplier": model["usage_multiplier"],
-                        "categories": [model["category"]]
+                        "categories": {model["category"]: None}
                     }
                 else:
-                    # Add category if model appears in multiple categories
-                    if model["category"] not in unique_models[model_id]["categories"]:
-                        unique_models[model_id]["categories"].append(model["category"])
+                    entry["categories"][model["category"]] = None
 
-        return list(unique_models.values())
+        for entry in by_id.values():
+            entry["categories"] = list(entry["categories"])
+        return list(by_id.values())
     except Exception:
         # Fallback to simple model list
         return [
@@ -325,4 +337,14 @@ def get_all_unique_models():
                 "display_name": "auto",
                 "description": "Auto-select best model"
             }
-        ] 
\ No newline at end of file
+        ]
+
+
+# The catalog is static, so the flattened list (and its `created` stamp,
+# pinned to process start) can be shared by every /v1/models response.
+_UNIQUE_MODELS = _build_unique_models()
+
+
+def get_all_unique_models():
+    """Get all unique models across all categories for OpenAI API compatibility"""
+    return _UNIQUE_MODELS
@@ -31,12 +31,13 @@ OS_CATEGORY = "Windows"
 OS_NAME = "Windows"
 OS_VERSION = "11 (26100)"
 
-# Protobuf field names for text detection
-TEXT_FIELD_NAMES = ("text", "prompt", "query", "content", "message", "input")
-PATH_HINT_BONUS = ("conversation", "query", "input", "user", "request", "delta")
+# Protobuf field names for text detection; frozensets so the scoring loop
+# in core/protobuf.py does hashed membership tests instead of tuple scans
+TEXT_FIELD_NAMES = frozenset({"text", "prompt", "query", "content", "message", "input"})
+PATH_HINT_BONUS = frozenset({"conversation", "query", "input", "user", "request", "delta"})
 
 # Response parsing configuration
-SYSTEM_STR = {"agent_output.text", "server_message_data", "USER_INITIATED", "agent_output", "text"}
+SYSTEM_STR = frozenset({"agent_output.text", "server_message_data", "USER_INITIATED", "agent_output", "text"})
 
 # JWT refresh configuration
 REFRESH_TOKEN_B64 = "Z3JhbnRfdHlwZT1yZWZyZXNoX3Rva2VuJnJlZnJlc2hfdG9rZW49QU1mLXZCeFNSbWRodmVHR0JZTTY5cDA1a0RoSW4xaTd3c2NBTEVtQzlmWURScEh6akVSOWRMN2trLWtIUFl3dlk5Uk9rbXk1MHFHVGNJaUpaNEFtODZoUFhrcFZQTDkwSEptQWY1Zlo3UGVqeXBkYmNLNHdzbzhLZjNheGlTV3RJUk9oT2NuOU56R2FTdmw3V3FSTU5PcEhHZ0JyWW40SThrclc1N1I4X3dzOHU3WGNTdzh1MERpTDlIcnBNbTBMdHdzQ2g4MWtfNmJiMkNXT0ViMWxJeDNIV1NCVGVQRldzUQ=="
@@ -5,28 +5,82 @@ Logging system for Warp API server
 
 Provides comprehensive logging with file rotation and console output.
 """
+import atexit
 import logging
 import os
+import queue
 import shutil
 from datetime import datetime
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
 from ..config.settings import LOGS_DIR
 
 
+# Listener thread draining the log queue into the real handlers; emit() on
+# the logger itself only enqueues, so request coroutines never block on
+# disk I/O for a log line.
+_LISTENER = None
+
+
+def _install_queue_handlers(target_logger, file_handler):
+    """Route the logger through a QueueHandler and (re)start the listener
+    that drains into file_handler + console."""
+    global _LISTENER
+
+    if _LISTENER is not None:
+        try:
+            _LISTENER.stop()
+        except Exception:
+            pass
+        _LISTENER = None
+
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(logging.INFO)
+
+    formatter = logging.Formatter(
+        '%(asctime)s - %(name)s - %(levelname)s - %(funcName)s:%(lineno)d - %(message)s'
+    )
+    file_handler.setFormatter(formatter)
+    console_handler.setFormatter(formatter)
+
+    for handler in target_logger.handlers[:]:
+        target_logger.removeHandler(handler)
+        if not isinstance(handler, QueueHandler):
+            try:
+                handler.close()
+            except Exception:
+                pass
+
+    log_queue = queue.SimpleQueue()
+    target_logger.addHandler(QueueHandler(log_queue))
+
+    _LISTENER = QueueListener(
+        log_queue, file_handler, console_handler, respect_handler_level=True
+    )
+    _LISTENER.start()
+    atexit.register(_LISTENER.stop)
+
+
 def backup_existing_log():
     """Backup existing log file with timestamp"""
     log_file = LOGS_DIR / 'warp_api.log'
 
-    if log_file.exists():
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        backup_name = f'warp_api_{timestamp}.log'
-        backup_path = LOGS_DIR / backup_name
+    try:
+        # Tiny logs (short-lived runs, import-only scripts) are not worth a
+        # rename each; anything under 4 KiB keeps appending to the same file.
+        if log_file.stat().st_size < 4096:
+            return
+    except OSError:
+        return
 
-        try:
-            shutil.move(str(log_file), str(backup_path))
-            print(f"Previous log backed up as: {backup_name}")
-        except Exception as e:
-            print(f"Warning: Could not backup log file: {e}")
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    backup_name = f'warp_api_{timestamp}.log'
+    backup_path = LOGS_DIR / backup_name
+
+    try:
+        shutil.move(str(log_file), str(backup_path))
+        print(f"Previous log backed up as: {backup_name}")
+    except Exception as e:
+        print(f"Warning: Could not backup log file: {e}")
 
 
 def setup_logging():
@@ -37,30 +91,19 @@ def setup_logging():
     
     logger = logging.getLogger('warp_api')
     logger.setLevel(logging.DEBUG)
-    
-    for handler in logger.handlers[:]:
-        logger.removeHandler(handler)
-    
-    file_handler = RotatingFileHandler(
+
+    # Timed rotation compares a cached rollover timestamp per record;
+    # size-based rotation would pay a file-size check on every emit.
+    file_handler = TimedRotatingFileHandler(
         LOGS_DIR / 'warp_api.log',
-        maxBytes=10*1024*1024,
-        backupCount=5,
+        when='H',
+        backupCount=24,
         encoding='utf-8'
     )
     file_handler.setLevel(logging.DEBUG)
-    
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
-    
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(funcName)s:%(lineno)d - %(message)s'
-    )
-    file_handler.setFormatter(formatter)
-    console_handler.setFormatter(formatter)
-    
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
-    
+
+    _install_queue_handlers(logger, file_handler)
+
     return logger
 
 
@@ -83,35 +126,15 @@ def set_log_file(log_file_name: str) -> None:
     global logger
     target_logger = logging.getLogger('warp_api')
 
-    for handler in target_logger.handlers[:]:
-        try:
-            target_logger.removeHandler(handler)
-            try:
-                handler.close()
-            except Exception:
-                pass
-        except Exception:
-            pass
-
-    file_handler = RotatingFileHandler(
+    file_handler = TimedRotatingFileHandler(
         LOGS_DIR / log_file_name,
-        maxBytes=10*1024*1024,
-        backupCount=5,
+        when='H',
+        backupCount=24,
         encoding='utf-8'
     )
     file_handler.setLevel(logging.DEBUG)
 
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
-
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(funcName)s:%(lineno)d - %(message)s'
-    )
-    file_handler.setFormatter(formatter)
-    console_handler.setFormatter(formatter)
-
-    target_logger.addHandler(file_handler)
-    target_logger.addHandler(console_handler)
+    _install_queue_handlers(target_logger, file_handler)
 
     logger = target_logger
 
@@ -5,6 +5,7 @@ Protobuf runtime for Warp API
 
 Handles protobuf compilation, message creation, and request building.
 """
+import functools
 import os
 import re
 import json
@@ -12,8 +13,13 @@ import time
 import uuid
 import pathlib
 import tempfile
+from collections import deque
 from typing import Any, Dict, List, Optional, Tuple
 
+# 必须在首次 import google.protobuf 之前生效：纯 Python 实现的
+# ParseFromString/SerializeToString 比 upb/C++ 慢一个数量级以上。
+os.environ.setdefault("PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION", "upb")
+
 from google.protobuf import descriptor_pool, descriptor_pb2
 from google.protobuf.descriptor import FieldDescriptor as FD
 from google.protobuf.message_factory import GetMessageClass
@@ -22,32 +28,55 @@ from google.protobuf import struct_pb2
 from ..config.settings import PROTO_DIR, CLIENT_VERSION, OS_CATEGORY, OS_NAME, OS_VERSION, TEXT_FIELD_NAMES, PATH_HINT_BONUS
 from .logging import logger, log
 
+try:
+    from google.protobuf.internal import api_implementation
+    if api_implementation.Type() not in ("upb", "cpp"):
+        logger.warning(
+            "protobuf is running the pure-python implementation (%s); "
+            "encode/decode will be an order of magnitude slower. "
+            "Install protobuf>=4 with the upb runtime.",
+            api_implementation.Type(),
+        )
+except Exception:
+    pass
+
 # Global protobuf state
 _pool: Optional[descriptor_pool.DescriptorPool] = None
 ALL_MSGS: List[str] = []
 
 
+ESSENTIAL_PROTO_FILES = (
+    "request.proto",
+    "response.proto",
+    "task.proto",
+    "attachment.proto",
+    "file_content.proto",
+    "input_context.proto",
+    "citations.proto",
+)
+
+# 启动路径常量：essential 文件相对 PROTO_DIR 的存在性在 import 时查一次，
+# 之后 _find_proto_files 的常规调用无需再碰磁盘。
+_ESSENTIAL_PROTO_PATHS = tuple(
+    str(p) for p in (PROTO_DIR / name for name in ESSENTIAL_PROTO_FILES) if p.exists()
+)
+
+
 def _find_proto_files(root: pathlib.Path) -> List[str]:
     """Find necessary .proto files in the given directory, excluding problematic test files"""
+    if root == PROTO_DIR and _ESSENTIAL_PROTO_PATHS:
+        logger.info("Selected %d proto files for compilation", len(_ESSENTIAL_PROTO_PATHS))
+        return list(_ESSENTIAL_PROTO_PATHS)
+
     if not root.exists():
         return []
-    
-    essential_files = [
-        "request.proto",
-        "response.proto", 
-        "task.proto",
-        "attachment.proto",
-        "file_content.proto",
-        "input_context.proto",
-        "citations.proto"
-    ]
-    
+
     found_files = []
-    for file_name in essential_files:
+    for file_name in ESSENTIAL_PROTO_FILES:
         file_path = root / file_name
         if file_path.exists():
             found_files.append(str(file_path))
-            logger.debug(f"Found essential proto file: {file_name}")
+            logger.debug("Found essential proto file: %s", file_name)
     
     if not found_files:
         logger.warning("Essential proto files not found, scanning all files...")
@@ -61,7 +90,7 @@ def _find_proto_files(root: pathlib.Path) -> List[str]:
             if not any(pattern in file_name for pattern in exclude_patterns):
                 found_files.append(str(proto_file))
     
-    logger.info(f"Selected {len(found_files)} proto files for compilation")
+    logger.info("Selected %d proto files for compilation", len(found_files))
     return found_files
 
 
@@ -104,43 +133,119 @@ def _load_pool_from_descset(descset: bytes):
                 walk(nested, full)
         for m in fd.message_type:
             walk(m, pkg)
+    global _TEXT_PATH_INDEX
     _pool, ALL_MSGS = pool, names
+    # The memoized classes and text-path index belong to the previous pool
+    msg_cls.cache_clear()
+    _TEXT_PATH_INDEX = None
+    _TEXT_PATHS_CACHE.clear()
     log(f"proto loaded: {len(ALL_MSGS)} message type(s)")
 
 
+# 随包分发的预编译 FileDescriptorSet：常规路径直接读它，省掉首次请求时
+# 几百毫秒的 protoc 子进程；bundle 缺失或比 .proto 源旧时才回退到现场编译。
+_BUNDLE_PATH = pathlib.Path(__file__).resolve().parents[1] / "proto" / "bundle.pb"
+
+
+def _packaged_descset() -> Optional[bytes]:
+    try:
+        bundle_mtime = _BUNDLE_PATH.stat().st_mtime
+    except OSError:
+        return None
+    try:
+        for proto_file in PROTO_DIR.glob("*.proto"):
+            if proto_file.stat().st_mtime > bundle_mtime:
+                logger.info("Proto source newer than bundle.pb, recompiling: %s", proto_file.name)
+                return None
+    except OSError:
+        pass
+    return _BUNDLE_PATH.read_bytes()
+
+
 def ensure_proto_runtime():
     if _pool is not None: 
         return
-    files = _find_proto_files(PROTO_DIR)
-    if not files:
-        raise RuntimeError(f"No .proto found under {PROTO_DIR}")
-    desc = _build_descset(files, [str(PROTO_DIR)])
+    desc = _packaged_descset()
+    if desc is None:
+        files = _find_proto_files(PROTO_DIR)
+        if not files:
+            raise RuntimeError(f"No .proto found under {PROTO_DIR}")
+        desc = _build_descset(files, [str(PROTO_DIR)])
     _load_pool_from_descset(desc)
 
 
+@functools.lru_cache(maxsize=None)
 def msg_cls(full: str):
+    """Resolve a message class by full name, memoized per type.
+
+    Descriptor-pool lookup plus GetMessageClass synthesis is paid once per
+    message type instead of on every encode/decode; callers must have run
+    ensure_proto_runtime() first (as they already do).
+    """
     desc = _pool.FindMessageTypeByName(full)  # type: ignore
     return GetMessageClass(desc)
 
 
+# 每个根消息的扫描结果缓存；共享子消息（Value/Metadata 之类）可以从很多
+# 路径到达，visited 守卫 + BFS（先到先探，短路径优先）避免指数级重复访问。
+_TEXT_PATHS_CACHE: Dict[str, List[Tuple[List[FD], int]]] = {}
+
+
 def _list_text_paths(desc, max_depth=6):
+    cached = _TEXT_PATHS_CACHE.get(desc.full_name)
+    if cached is not None:
+        return cached
     out: List[Tuple[List[FD], int]] = []
-    def walk(cur_desc, cur_path: List[FD], depth: int):
-        if depth > max_depth:
-            return
+    queue = deque([(desc, [], 0)])
+    seen = {id(desc)}
+    while queue:
+        cur_desc, cur_path, depth = queue.popleft()
         for f in cur_desc.fields:
-            base = 0
-            if f.name.lower() in TEXT_FIELD_NAMES: base += 10
+            lname = f.name.lower()
+            base = 10 if lname in TEXT_FIELD_NAMES else 0
             for hint in PATH_HINT_BONUS:
-                if hint in f.name.lower(): base += 2
+                if hint in lname: base += 2
             if f.type == FD.TYPE_STRING:
                 out.append((cur_path + [f], base + depth))
-            elif f.type == FD.TYPE_MESSAGE:
-                walk(f.message_type, cur_path + [f], depth + 1)
-    walk(desc, [], 0)
+            elif f.type == FD.TYPE_MESSAGE and depth < max_depth:
+                sub = f.message_type
+                if id(sub) not in seen:
+                    seen.add(id(sub))
+                    queue.append((sub, cur_path + [f], depth + 1))
+    _TEXT_PATHS_CACHE[desc.full_name] = out
     return out
 
 
+# 自动探测回退用的扁平索引：每个消息只在 pool 里查一次、只递归扫一次，
+# 结果为 (full_name, 最佳文本路径, 含 name_bias 的总分)；pool 重载时重建。
+_TEXT_PATH_INDEX: Optional[List[Tuple[str, List[FD], int]]] = None
+
+_NAME_BIAS_KEYWORDS = (("request", 8), ("multi_agent", 6), ("multiagent", 6),
+                       ("chat", 5), ("client", 2), ("message", 1), ("input", 1))
+
+
+def _build_text_path_index() -> List[Tuple[str, List[FD], int]]:
+    index: List[Tuple[str, List[FD], int]] = []
+    for full in ALL_MSGS:
+        try:
+            d = _pool.FindMessageTypeByName(full)  # type: ignore
+        except Exception:
+            continue
+        name_bias = 0
+        lname = full.lower()
+        for kw, w in _NAME_BIAS_KEYWORDS:
+            if kw in lname: name_bias += w
+        best_path: Optional[List[FD]] = None
+        best_total = 0
+        for path, score in _list_text_paths(d):
+            total = score + name_bias + max(0, 6 - len(path))
+            if best_path is None or total > best_total:
+                best_path, best_total = path, total
+        if best_path is not None:
+            index.append((full, best_path, best_total))
+    return index
+
+
 def _pick_best_request_schema() -> Tuple[str, List[FD]]:
     ensure_proto_runtime()
     try:
@@ -163,24 +268,12 @@ def _pick_best_request_schema() -> Tuple[str, List[FD]]:
         
     except Exception as e:
         log(f"Failed to use modern format, falling back to auto-detection: {e}")
-        best: Optional[Tuple[str, List[FD], int]] = None
-        for full in ALL_MSGS:
-            try:
-                d = _pool.FindMessageTypeByName(full)  # type: ignore
-            except Exception:
-                continue
-            name_bias = 0
-            lname = full.lower()
-            for kw, w in (("request", 8), ("multi_agent", 6), ("multiagent", 6),
-                          ("chat", 5), ("client", 2), ("message", 1), ("input", 1)):
-                if kw in lname: name_bias += w
-            for path, score in _list_text_paths(d):
-                total = score + name_bias + max(0, 6 - len(path))
-                if best is None or total > best[2]:
-                    best = (full, path, total)
-        if not best:
+        global _TEXT_PATH_INDEX
+        if _TEXT_PATH_INDEX is None:
+            _TEXT_PATH_INDEX = _build_text_path_index()
+        if not _TEXT_PATH_INDEX:
             raise RuntimeError("Could not auto-detect request root & text field from proto/")
-        full, path, _ = best
+        full, path, _ = max(_TEXT_PATH_INDEX, key=lambda entry: entry[2])
         log("auto-detected request:", full, " :: ", ".".join(f.name for f in path))
         return full, path
 
@@ -194,91 +287,122 @@ def get_request_schema() -> Tuple[str, List[FD]]:
     return _REQ_CACHE
 
 
-def _set_text_at_path(msg, path_fields: List[FD], text: str):
-    cur = msg
-    for i, f in enumerate(path_fields):
-        last = (i == len(path_fields) - 1)
+def _compile_text_path(path_fields: List[FD]) -> tuple:
+    """把 FD 路径编译成 (name, is_message, is_string, is_repeated) 元组序列。
+
+    is_repeated 的 try/except 探测和 f.type 比较随 schema 固定，编译一次后
+    每个请求的写入只剩纯元组遍历和 getattr/setattr。
+    """
+    plan = []
+    for f in path_fields:
         try:
             is_repeated = f.is_repeated
         except AttributeError:
             is_repeated = (f.label == FD.LABEL_REPEATED)
-        
+        plan.append((f.name, f.type == FD.TYPE_MESSAGE, f.type == FD.TYPE_STRING, bool(is_repeated)))
+    return tuple(plan)
+
+
+def _set_text_at_path(msg, path_plan: tuple, text: str):
+    cur = msg
+    last_i = len(path_plan) - 1
+    for i, (name, is_message, is_string, is_repeated) in enumerate(path_plan):
+        last = (i == last_i)
         if is_repeated:
-            rep = getattr(cur, f.name)
-            if f.type == FD.TYPE_MESSAGE:
+            rep = getattr(cur, name)
+            if is_message:
                 cur = rep.add()
-            elif f.type == FD.TYPE_STRING:
-                if not last: raise TypeError(f"path continues after repeated string field '{f.name}'")
+            elif is_string:
+                if not last: raise TypeError(f"path continues after repeated string field '{name}'")
                 rep.append(text); return
             else:
-                raise TypeError(f"unsupported repeated scalar at '{f.name}'")
+                raise TypeError(f"unsupported repeated scalar at '{name}'")
         else:
-            if f.type == FD.TYPE_MESSAGE:
-                cur = getattr(cur, f.name)
+            if is_message:
+                cur = getattr(cur, name)
                 if last:
-                    raise TypeError(f"last field '{f.name}' is a message, not string")
-            elif f.type == FD.TYPE_STRING:
-                if not last: raise TypeError(f"path continues after string field '{f.name}'")
-                setattr(cur, f.name, text); return
+                    raise TypeError(f"last field '{name}' is a message, not string")
+            elif is_string:
+                if not last: raise TypeError(f"path continues after string field '{name}'")
+                setattr(cur, name, text); return
             else:
-                raise TypeError(f"unsupported scalar at '{f.name}'")
+                raise TypeError(f"unsupported scalar at '{name}'")
     raise RuntimeError("failed to set text")
 
 
+# 请求模板缓存：(Cls, path_plan, template_bytes, has_model_config, has_metadata)。
+# 所有静态字段（settings 开关、版本/OS 字段）首次调用时填好并序列化；
+# 之后每个请求只需 ParseFromString 模板再写入文本、模型和 conversation_id，
+# 免去 hasattr 链和十几个 setattr。
+_TEMPLATE_CACHE: Optional[Tuple[Any, List[FD], bytes, bool, bool]] = None
+
+
+def _request_template() -> Tuple[Any, List[FD], bytes, bool, bool]:
+    global _TEMPLATE_CACHE
+    if _TEMPLATE_CACHE is None:
+        full, path = get_request_schema()
+        Cls = msg_cls(full)
+        msg = Cls()
+
+        has_model_config = False
+        if hasattr(msg, 'settings'):
+            settings = msg.settings
+            has_model_config = hasattr(settings, 'model_config')
+
+            settings.rules_enabled = False
+            settings.web_context_retrieval_enabled = False
+            settings.supports_parallel_tool_calls = False
+            settings.planning_enabled = False
+            settings.supports_create_files = False
+            settings.supports_long_running_commands = False
+            settings.supports_todos_ui = False
+            settings.supports_linked_code_blocks = False
+
+            settings.use_anthropic_text_editor_tools = False
+            settings.warp_drive_context_enabled = False
+            settings.should_preserve_file_content_in_history = True
+
+            try:
+                tool_types = []
+                settings.supported_tools[:] = tool_types
+                logger.debug("Set supported_tools (legacy): %s", tool_types)
+            except Exception as e:
+                logger.debug("Could not set supported_tools: %s", e)
+
+            logger.debug("Applied all valid Settings fields based on proto definition")
+
+        rootd = msg.DESCRIPTOR
+        for fn, val in (
+            ("client_version", CLIENT_VERSION),
+            ("version", CLIENT_VERSION),
+            ("os_name", OS_NAME),
+            ("os_category", OS_CATEGORY),
+            ("os_version", OS_VERSION),
+        ):
+            f = rootd.fields_by_name.get(fn)
+            if f and f.type == FD.TYPE_STRING and f.label == FD.LABEL_OPTIONAL:
+                setattr(msg, fn, val)
+
+        _TEMPLATE_CACHE = (Cls, _compile_text_path(path), msg.SerializeToString(), has_model_config, hasattr(msg, 'metadata'))
+    return _TEMPLATE_CACHE
+
+
 def build_request_bytes(user_text: str, model: str = "auto") -> bytes:
     from ..config.models import get_model_config
 
-    full, path = get_request_schema()
-    Cls = msg_cls(full)
+    Cls, path_plan, template_bytes, has_model_config, has_metadata = _request_template()
     msg = Cls()
-    _set_text_at_path(msg, path, user_text)
-
-    if hasattr(msg, 'settings'):
-        settings = msg.settings
-        if hasattr(settings, 'model_config'):
-            model_config_dict = get_model_config(model)
-            model_config = settings.model_config
-            model_config.base = model_config_dict["base"]
-            model_config.planning = model_config_dict["planning"]
-            model_config.coding = model_config_dict["coding"]
-            logger.debug(f"Set model config: base={model_config.base}, planning={model_config.planning}, coding={model_config.coding}")
-
-        settings.rules_enabled = False
-        settings.web_context_retrieval_enabled = False
-        settings.supports_parallel_tool_calls = False
-        settings.planning_enabled = False
-        settings.supports_create_files = False
-        settings.supports_long_running_commands = False
-        settings.supports_todos_ui = False
-        settings.supports_linked_code_blocks = False
-
-        settings.use_anthropic_text_editor_tools = False
-        settings.warp_drive_context_enabled = False
-        settings.should_preserve_file_content_in_history = True
-
-        try:
-            tool_types = []
-            settings.supported_tools[:] = tool_types
-            logger.debug(f"Set supported_tools (legacy): {tool_types}")
-        except Exception as e:
-            logger.debug(f"Could not set supported_tools: {e}")
-
-        logger.debug("Applied all valid Settings fields based on proto definition")
-
-    if hasattr(msg, 'metadata'):
-        metadata = msg.metadata
-        metadata.conversation_id = f"rest-api-{uuid.uuid4().hex[:8]}"
-
-    rootd = msg.DESCRIPTOR
-    for fn, val in (
-        ("client_version", CLIENT_VERSION),
-        ("version", CLIENT_VERSION),
-        ("os_name", OS_NAME),
-        ("os_category", OS_CATEGORY),
-        ("os_version", OS_VERSION),
-    ):
-        f = rootd.fields_by_name.get(fn)
-        if f and f.type == FD.TYPE_STRING and f.label == FD.LABEL_OPTIONAL:
-            setattr(msg, fn, val)
+    msg.ParseFromString(template_bytes)
+    _set_text_at_path(msg, path_plan, user_text)
+
+    if has_model_config:
+        model_config_dict = get_model_config(model)
+        model_config = msg.settings.model_config
+        model_config.base = model_config_dict["base"]
+        model_config.planning = model_config_dict["planning"]
+        model_config.coding = model_config_dict["coding"]
+
+    if has_metadata:
+        msg.metadata.conversation_id = f"rest-api-{uuid.uuid4().hex[:8]}"
 
     return msg.SerializeToString() 
\ No newline at end of file
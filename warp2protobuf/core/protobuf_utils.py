@@ -14,6 +14,26 @@ from google.protobuf import struct_pb2
 from google.protobuf.descriptor import FieldDescriptor as _FD
 from .server_message_data import decode_server_message_data, encode_server_message_data
 
+try:
+    from orjson import dumps as _orjson_dumps
+except ImportError:  # pragma: no cover - gate becomes a no-op without orjson
+    _orjson_dumps = None
+
+# server_message_data 在典型请求里根本不出现；先用一次 C 速度的序列化 +
+# 子串查找做门禁，命中才做 Python 层的整树遍历。
+_SMD_MARKER_SNAKE = b'"server_message_data"'
+_SMD_MARKER_CAMEL = b'"serverMessageData"'
+
+
+def _maybe_has_smd(obj: Any) -> bool:
+    if _orjson_dumps is None:
+        return True
+    try:
+        blob = _orjson_dumps(obj)
+    except Exception:
+        return True
+    return _SMD_MARKER_SNAKE in blob or _SMD_MARKER_CAMEL in blob
+
 
 
 
@@ -27,10 +47,13 @@ def protobuf_to_dict(protobuf_bytes: bytes, message_type: str) -> Dict:
         message = MessageClass()
         message.ParseFromString(protobuf_bytes)
         
+        # 保持 MessageToDict：upb 运行时下 MessageToJson 仍是纯 Python
+        # （内部就是 MessageToDict + json.dumps），经 orjson 回读反而更慢
         data = MessageToDict(message, preserving_proto_field_name=True)
-        
+
         # 在转换阶段自动解析 server_message_data（Base64URL -> 结构化对象）
-        data = _decode_smd_inplace(data)
+        if _maybe_has_smd(data):
+            data = _decode_smd_inplace(data)
         return data
     
     except Exception as e:
@@ -46,11 +69,13 @@ def dict_to_protobuf_bytes(data_dict: Dict, message_type: str = "warp.multi_agen
     ensure_proto_runtime()
     
     try:
+        # 每次新建实例：upb 下消息构造在 C 层完成，实测比 Clear() 复用更快，
+        # 实例池反而引入线程安全负担
         MessageClass = msg_cls(message_type)
         message = MessageClass()
-        
+
         # 在转换阶段自动处理 server_message_data（对象 -> Base64URL 字符串）
-        safe_dict = _encode_smd_inplace(data_dict)
+        safe_dict = _encode_smd_inplace(data_dict) if _maybe_has_smd(data_dict) else data_dict
         
         _populate_protobuf_from_dict(message, safe_dict, path="$")
         
@@ -63,33 +88,65 @@ def dict_to_protobuf_bytes(data_dict: Dict, message_type: str = "warp.multi_agen
 
 
 
+# type(v) 直接查表分发，省掉每个叶子最多 6 次 isinstance；大体量工具参数
+# （嵌套 Struct 里成百上千个叶子）时收益明显。子类等罕见类型走兜底分支。
+def _fill_null(value_msg: Any, py_value: Any) -> None:
+    value_msg.null_value = 0
+
+
+def _fill_bool(value_msg: Any, py_value: Any) -> None:
+    value_msg.bool_value = py_value
+
+
+def _fill_number(value_msg: Any, py_value: Any) -> None:
+    value_msg.number_value = float(py_value)
+
+
+def _fill_str(value_msg: Any, py_value: Any) -> None:
+    value_msg.string_value = py_value
+
+
+def _fill_dict(value_msg: Any, py_value: Any) -> None:
+    _fill_google_struct_dynamic(value_msg.struct_value, py_value)
+
+
+def _fill_list(value_msg: Any, py_value: Any) -> None:
+    values_rep = value_msg.list_value.values
+    for item in py_value:
+        _fill_google_value_dynamic(values_rep.add(), item)
+
+
+_VALUE_FILLERS = {
+    type(None): _fill_null,
+    bool: _fill_bool,
+    int: _fill_number,
+    float: _fill_number,
+    str: _fill_str,
+    dict: _fill_dict,
+    list: _fill_list,
+}
+
+
 def _fill_google_value_dynamic(value_msg: Any, py_value: Any) -> None:
     """在动态 google.protobuf.Value 消息上填充 Python 值（不创建 struct_pb2.Value 实例）。"""
     try:
-        if py_value is None:
-            setattr(value_msg, "null_value", 0)
+        fn = _VALUE_FILLERS.get(type(py_value))
+        if fn is not None:
+            fn(value_msg, py_value)
             return
+        # 兜底：子类（如 IntEnum、OrderedDict）仍按 isinstance 归类
         if isinstance(py_value, bool):
-            setattr(value_msg, "bool_value", bool(py_value))
-            return
-        if isinstance(py_value, (int, float)):
-            setattr(value_msg, "number_value", float(py_value))
-            return
-        if isinstance(py_value, str):
-            setattr(value_msg, "string_value", py_value)
-            return
-        if isinstance(py_value, dict):
-            struct_value = getattr(value_msg, "struct_value")
-            _fill_google_struct_dynamic(struct_value, py_value)
-            return
-        if isinstance(py_value, list):
-            list_value = getattr(value_msg, "list_value")
-            values_rep = getattr(list_value, "values")
-            for item in py_value:
-                sub = values_rep.add()
-                _fill_google_value_dynamic(sub, item)
-            return
-        setattr(value_msg, "string_value", str(py_value))
+            value_msg.bool_value = bool(py_value)
+        elif isinstance(py_value, (int, float)):
+            value_msg.number_value = float(py_value)
+        elif isinstance(py_value, str):
+            value_msg.string_value = py_value
+        elif isinstance(py_value, dict):
+            _fill_google_struct_dynamic(value_msg.struct_value, py_value)
+        elif isinstance(py_value, list):
+            _fill_list(value_msg, py_value)
+        else:
+            value_msg.string_value = str(py_value)
     except Exception as e:
         logger.warning(f"填充 google.protobuf.Value 失败: {e}")
 
@@ -109,139 +166,133 @@ def _fill_google_struct_dynamic(struct_msg: Any, py_dict: Dict[str, Any]) -> Non
 
 
 
-def _python_to_struct_value(py_value: Any) -> struct_pb2.Value:
-    v = struct_pb2.Value()
-    if py_value is None:
-        v.null_value = struct_pb2.NULL_VALUE
-    elif isinstance(py_value, bool):
-        v.bool_value = bool(py_value)
-    elif isinstance(py_value, (int, float)):
-        v.number_value = float(py_value)
-    elif isinstance(py_value, str):
-        v.string_value = py_value
-    elif isinstance(py_value, dict):
-        s = struct_pb2.Struct()
-        s.update(py_value)
-        v.struct_value.CopyFrom(s)
-    elif isinstance(py_value, list):
-        lv = struct_pb2.ListValue()
-        for item in py_value:
-            lv.values.append(_python_to_struct_value(item))
-        v.list_value.CopyFrom(lv)
-    else:
-        v.string_value = str(py_value)
-    return v
+# 每个 descriptor 的字段元数据：name -> (fd, is_struct, is_map, map_value_desc,
+# map_value_is_value, enum_map)。GetOptions()、full_name 比较和枚举名->数值
+# 表只在首次遇到该消息类型时构建一次；descriptor 对象由 pool 持有且进程内
+# 稳定，普通 dict 即可（upb 的 descriptor 不支持弱引用）。
+_FIELD_META_CACHE: Dict[Any, Dict[str, tuple]] = {}
 
 
+def _get_field_meta(descriptor) -> Dict[str, tuple]:
+    meta = _FIELD_META_CACHE.get(descriptor)
+    if meta is None:
+        meta = {}
+        for fd in descriptor.fields:
+            is_msg = fd.type == _FD.TYPE_MESSAGE and fd.message_type is not None
+            is_struct = is_msg and fd.message_type.full_name == "google.protobuf.Struct"
+            is_map = bool(is_msg and fd.message_type.GetOptions().map_entry)
+            map_value_desc = fd.message_type.fields_by_name.get("value") if is_map else None
+            map_value_is_value = (
+                map_value_desc is not None
+                and map_value_desc.type == _FD.TYPE_MESSAGE
+                and map_value_desc.message_type is not None
+                and map_value_desc.message_type.full_name == "google.protobuf.Value"
+            )
+            enum_map = None
+            if fd.type == _FD.TYPE_ENUM and fd.enum_type is not None:
+                enum_map = {ev.name: ev.number for ev in fd.enum_type.values}
+            meta[fd.name] = (fd, is_struct, is_map, map_value_desc, map_value_is_value, enum_map)
+        _FIELD_META_CACHE[descriptor] = meta
+    return meta
 
 
 def _populate_protobuf_from_dict(proto_msg, data_dict: Dict, path: str = "$"):
+    descriptor = getattr(proto_msg, "DESCRIPTOR", None)
+    meta = _get_field_meta(descriptor) if descriptor is not None else {}
+    # 路径字符串只在告警/递归分支里构造，常规字段不再为日志预拼 f-string
     for key, value in data_dict.items():
-        current_path = f"{path}.{key}"
         if not hasattr(proto_msg, key):
-            logger.warning(f"忽略未知字段: {current_path}")
+            logger.warning(f"忽略未知字段: {path}.{key}")
             continue
             
         field = getattr(proto_msg, key)
-        fd = None
-        descriptor = getattr(proto_msg, "DESCRIPTOR", None)
-        if descriptor is not None:
-            fd = descriptor.fields_by_name.get(key)
+        fm = meta.get(key)
+        fd = fm[0] if fm is not None else None
         
         try:
-            if (
-                fd is not None
-                and fd.type == _FD.TYPE_MESSAGE
-                and fd.message_type is not None
-                and fd.message_type.full_name == "google.protobuf.Struct"
-                and isinstance(value, dict)
-            ):
+            if fm is not None and fm[1] and isinstance(value, dict):
                 _fill_google_struct_dynamic(field, value)
                 continue
         except Exception as e:
-            logger.warning(f"处理 Struct 字段 {current_path} 失败: {e}")
+            logger.warning(f"处理 Struct 字段 {path}.{key} 失败: {e}")
 
         if isinstance(field, struct_pb2.Struct) and isinstance(value, dict):
             try:
                 field.update(value)
             except Exception as e:
-                logger.warning(f"填充Struct失败: {current_path}: {e}")
+                logger.warning(f"填充Struct失败: {path}.{key}: {e}")
             continue
 
         try:
-            if (
-                fd is not None
-                and fd.type == _FD.TYPE_MESSAGE
-                and fd.message_type is not None
-                and fd.message_type.GetOptions().map_entry
-                and isinstance(value, dict)
-            ):
-                value_desc = fd.message_type.fields_by_name.get("value")
+            if fm is not None and fm[2] and isinstance(value, dict):
+                value_desc = fm[3]
+                value_is_message = value_desc is not None and value_desc.type == _FD.TYPE_MESSAGE
+                value_is_google_value = fm[4]
                 for mk, mv in value.items():
                     try:
-                        if value_desc is not None and value_desc.type == _FD.TYPE_MESSAGE:
-                            if value_desc.message_type is not None and value_desc.message_type.full_name == "google.protobuf.Value":
+                        if value_is_message:
+                            if value_is_google_value:
                                 _fill_google_value_dynamic(field[mk], mv)
                             else:
                                 sub_msg = field[mk]
                                 if isinstance(mv, dict):
-                                    _populate_protobuf_from_dict(sub_msg, mv, path=f"{current_path}.{mk}")
+                                    _populate_protobuf_from_dict(sub_msg, mv, path=f"{path}.{key}.{mk}")
                                 else:
                                     try:
-                                        logger.warning(f"map值类型不匹配，期望message: {current_path}.{mk}")
+                                        logger.warning(f"map值类型不匹配，期望message: {path}.{key}.{mk}")
                                     except Exception:
                                         pass
                         else:
                             field[mk] = mv
                     except Exception as me:
-                        logger.warning(f"设置 map 字段 {current_path}.{mk} 失败: {me}")
+                        logger.warning(f"设置 map 字段 {path}.{key}.{mk} 失败: {me}")
                 continue
         except Exception as e:
-            logger.warning(f"处理 map 字段 {current_path} 失败: {e}")
+            logger.warning(f"处理 map 字段 {path}.{key} 失败: {e}")
         
         if isinstance(value, dict):
             try:
-                _populate_protobuf_from_dict(field, value, path=current_path)
+                _populate_protobuf_from_dict(field, value, path=f"{path}.{key}")
             except Exception as e:
-                logger.error(f"填充子消息失败: {current_path}: {e}")
+                logger.error(f"填充子消息失败: {path}.{key}: {e}")
                 raise
         elif isinstance(value, list):
             # 处理 repeated enum：允许传入字符串名称或数字
             try:
                 if fd is not None and fd.type == _FD.TYPE_ENUM:
-                    enum_desc = getattr(fd, "enum_type", None)
+                    enum_map = fm[5] or {}
                     resolved_values = []
                     for item in value:
                         if isinstance(item, str):
-                            ev = enum_desc.values_by_name.get(item) if enum_desc is not None else None
-                            if ev is not None:
-                                resolved_values.append(ev.number)
+                            n = enum_map.get(item)
+                            if n is not None:
+                                resolved_values.append(n)
                             else:
                                 try:
                                     resolved_values.append(int(item))
                                 except Exception:
-                                    logger.warning(f"无法解析枚举值 '{item}' 为 {current_path}，已忽略")
+                                    logger.warning(f"无法解析枚举值 '{item}' 为 {path}.{key}，已忽略")
                         else:
                             try:
                                 resolved_values.append(int(item))
                             except Exception:
-                                logger.warning(f"无法转换枚举值 {item} 为整数: {current_path}")
+                                logger.warning(f"无法转换枚举值 {item} 为整数: {path}.{key}")
                     field.extend(resolved_values)
                     continue
             except Exception as e:
-                logger.warning(f"处理 repeated enum 字段 {current_path} 失败: {e}")
+                logger.warning(f"处理 repeated enum 字段 {path}.{key} 失败: {e}")
             if value and isinstance(value[0], dict):
                 try:
                     for idx, item in enumerate(value):
                         new_item = field.add()  # type: ignore[attr-defined]
-                        _populate_protobuf_from_dict(new_item, item, path=f"{current_path}[{idx}]")
+                        _populate_protobuf_from_dict(new_item, item, path=f"{path}.{key}[{idx}]")
                 except Exception as e:
-                    logger.warning(f"填充复合数组失败 {current_path}: {e}")
+                    logger.warning(f"填充复合数组失败 {path}.{key}: {e}")
             else:
                 try:
                     field.extend(value)
                 except Exception as e:
-                    logger.warning(f"设置数组字段 {current_path} 失败: {e}")
+                    logger.warning(f"设置数组字段 {path}.{key} 失败: {e}")
         else:
             if key in ["in_progress", "resume_conversation"]:
                 field.SetInParent()
@@ -249,11 +300,11 @@ def _populate_protobuf_from_dict(proto_msg, data_dict: Dict, path: str = "$"):
                 try:
                     # 处理标量 enum：允许传入字符串名称或数字
                     if fd is not None and fd.type == _FD.TYPE_ENUM:
-                        enum_desc = getattr(fd, "enum_type", None)
+                        enum_map = fm[5] or {}
                         if isinstance(value, str):
-                            ev = enum_desc.values_by_name.get(value) if enum_desc is not None else None
-                            if ev is not None:
-                                setattr(proto_msg, key, ev.number)
+                            n = enum_map.get(value)
+                            if n is not None:
+                                setattr(proto_msg, key, n)
                                 continue
                             try:
                                 setattr(proto_msg, key, int(value))
@@ -263,48 +314,50 @@ def _populate_protobuf_from_dict(proto_msg, data_dict: Dict, path: str = "$"):
                         # 其余情况直接赋值，若类型不匹配由底层抛错
                     setattr(proto_msg, key, value)
                 except Exception as e:
-                    logger.warning(f"设置字段 {current_path} 失败: {e}")
+                    logger.warning(f"设置字段 {path}.{key} 失败: {e}")
 
 
 # ===== server_message_data 递归处理 =====
 
 def _encode_smd_inplace(obj: Any) -> Any:
+    """原地编码 server_message_data（会修改传入对象，返回同一引用）。
+
+    旧实现逐层重建整棵 dict/list 树；SMD 键在典型请求里很少出现，
+    现在只覆写命中的键，其余节点原样保留，省掉 O(节点数) 的分配。
+    """
     if isinstance(obj, dict):
-        new_d: Dict[str, Any] = {}
         for k, v in obj.items():
             if k in ("server_message_data", "serverMessageData") and isinstance(v, dict):
                 try:
-                    b64 = encode_server_message_data(
+                    obj[k] = encode_server_message_data(
                         uuid=v.get("uuid"),
                         seconds=v.get("seconds"),
                         nanos=v.get("nanos"),
                     )
-                    new_d[k] = b64
                 except Exception:
-                    new_d[k] = v
-            else:
-                new_d[k] = _encode_smd_inplace(v)
-        return new_d
+                    pass
+            elif isinstance(v, (dict, list)):
+                _encode_smd_inplace(v)
     elif isinstance(obj, list):
-        return [_encode_smd_inplace(x) for x in obj]
-    else:
-        return obj
+        for item in obj:
+            if isinstance(item, (dict, list)):
+                _encode_smd_inplace(item)
+    return obj
 
 
 def _decode_smd_inplace(obj: Any) -> Any:
+    """原地解码 server_message_data（会修改传入对象，返回同一引用）。"""
     if isinstance(obj, dict):
-        new_d: Dict[str, Any] = {}
         for k, v in obj.items():
             if k in ("server_message_data", "serverMessageData") and isinstance(v, str):
                 try:
-                    dec = decode_server_message_data(v)
-                    new_d[k] = dec
+                    obj[k] = decode_server_message_data(v)
                 except Exception:
-                    new_d[k] = v
-            else:
-                new_d[k] = _decode_smd_inplace(v)
-        return new_d
+                    pass
+            elif isinstance(v, (dict, list)):
+                _decode_smd_inplace(v)
     elif isinstance(obj, list):
-        return [_decode_smd_inplace(x) for x in obj]
-    else:
-        return obj 
\ No newline at end of file
+        for item in obj:
+            if isinstance(item, (dict, list)):
+                _decode_smd_inplace(item)
+    return obj 
\ No newline at end of file
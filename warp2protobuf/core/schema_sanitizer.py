@@ -17,7 +17,45 @@ def _is_empty_value(value: Any) -> bool:
     return False
 
 
+def _needs_clean(value: Any) -> bool:
+    """Read-only scan: would _deep_clean change this value at all?
+
+    Runs over the whole packet on every request, so it is written as an
+    iterative walker with the container types hoisted to locals and the
+    empty-value test inlined; the recursive rebuild below only runs for
+    the rare dirty packet. Exact-type checks suffice here because packets
+    come from JSON parsing.
+    """
+    _dict, _list, _str = dict, list, str
+    stack = [value]
+    push = stack.append
+    while stack:
+        node = stack.pop()
+        cls = node.__class__
+        if cls is _str:
+            if node != node.strip():
+                return True
+            continue
+        children = node.values() if cls is _dict else node if cls is _list else ()
+        for v in children:
+            if v is None:
+                return True
+            vcls = v.__class__
+            if vcls is _str:
+                if not v or v != v.strip():
+                    return True
+            elif vcls is _dict or vcls is _list:
+                if not v:
+                    return True
+                push(v)
+    return False
+
+
 def _deep_clean(value: Any) -> Any:
+    # Most packets arrive already clean; detect that with a read-only pass
+    # and hand the original back instead of rebuilding every container.
+    if isinstance(value, (dict, list)) and not _needs_clean(value):
+        return value
     if isinstance(value, dict):
         cleaned: Dict[str, Any] = {}
         for k, v in value.items():
@@ -140,6 +178,9 @@ def sanitize_mcp_input_schema_in_packet(body: Dict[str, Any]) -> Dict[str, Any]:
     - Ensures each property has non-empty `type` and `description`
     - Special-cases `headers` to include at least `user-agent` when empty
     - Fixes `required` lists and general JSON Schema shape
+
+    Tool dicts are sanitized in place; callers already treat the return
+    value as the packet to send onwards.
     """
     try:
         body = _deep_clean(body)
@@ -157,19 +198,17 @@ def sanitize_mcp_input_schema_in_packet(body: Dict[str, Any]) -> Dict[str, Any]:
             tools = mcp_ctx.get("tools")
             if not isinstance(tools, list):
                 continue
-            fixed_tools: List[Any] = []
             for tool in tools:
                 if not isinstance(tool, dict):
-                    fixed_tools.append(tool)
                     continue
-                tool_copy = dict(tool)
-                input_schema = tool_copy.get("input_schema") or tool_copy.get("inputSchema")
+                # No trailing _deep_clean: the entry-point clean covered the
+                # tool's outer fields and _sanitize_json_schema cleans the
+                # schema itself.
+                input_schema = tool.get("input_schema") or tool.get("inputSchema")
                 if isinstance(input_schema, dict):
-                    tool_copy["input_schema"] = _sanitize_json_schema(input_schema)
-                    if "inputSchema" in tool_copy:
-                        tool_copy["inputSchema"] = tool_copy["input_schema"]
-                fixed_tools.append(_deep_clean(tool_copy))
-            mcp_ctx["tools"] = fixed_tools
+                    tool["input_schema"] = _sanitize_json_schema(input_schema)
+                    if "inputSchema" in tool:
+                        tool["inputSchema"] = tool["input_schema"]
         return body
     except Exception:
         return body 
\ No newline at end of file
@@ -5,9 +5,10 @@ Global session management for Warp API
 
 Manages fixed conversation_id and task context based on real packet analysis.
 """
-import uuid
+import os
 import time
 import asyncio
+import logging
 from typing import Dict, List, Optional, Any
 from dataclasses import dataclass, field
 from .logging import logger
@@ -52,7 +53,9 @@ class GlobalSessionManager:
         return FIXED_CONVERSATION_ID
     
     def add_message_from_openai(self, role: str, content: str, tool_calls: Optional[List[Dict]] = None, tool_call_id: Optional[str] = None) -> str:
-        message_id = f"msg-{uuid.uuid4().hex[:8]}"
+        # 8 hex chars of randomness without building a whole UUID object
+        # and slicing its 32-char string.
+        message_id = f"msg-{os.urandom(4).hex()}"
         message = SessionMessage(
             id=message_id,
             role=role,
@@ -74,7 +77,10 @@ class GlobalSessionManager:
         return self._session.messages.copy()
     
     def update_session_with_openai_messages(self, openai_messages: List[Dict[str, Any]]) -> None:
-        self._session.messages.clear()
+        # Bulk rebuild: one time.time() and one log line for the whole
+        # batch instead of a syscall plus a DEBUG dispatch per message.
+        now = time.time()
+        messages = []
         for msg in openai_messages:
             role = msg.get("role", "")
             content = msg.get("content", "")
@@ -82,23 +88,44 @@ class GlobalSessionManager:
             tool_call_id = msg.get("tool_call_id")
             if not content and not tool_calls and role != "tool":
                 continue
-            self.add_message_from_openai(role, content, tool_calls, tool_call_id)
-        logger.debug(f"Updated session with {len(openai_messages)} OpenAI messages")
+            messages.append(SessionMessage(
+                id=f"msg-{os.urandom(4).hex()}",
+                role=role,
+                content=content,
+                tool_calls=tool_calls,
+                tool_call_id=tool_call_id,
+                timestamp=now
+            ))
+        self._session.messages = messages
+        self._session.last_activity = now
+        logger.debug(f"Updated session with {len(messages)} of {len(openai_messages)} OpenAI messages")
     
     def extract_current_user_query(self, openai_messages: List[Dict[str, Any]]) -> Optional[str]:
-        for msg in reversed(openai_messages):
-            if msg.get("role") == "user":
-                query = msg.get("content", "")
-                logger.debug(f"Extracted current user query: {query[:100]}...")
-                return query
-        return None
+        # Dominant case: the request ends with the user's message, so the
+        # query is an O(1) index away; scan backwards only otherwise.
+        last = openai_messages[-1] if openai_messages else None
+        if last is not None and last.get("role") == "user":
+            query = last.get("content", "")
+        else:
+            query = next(
+                (msg.get("content", "") for msg in reversed(openai_messages)
+                 if msg.get("role") == "user"),
+                None
+            )
+            if query is None:
+                return None
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Extracted current user query: {query[:100]}...")
+        return query
     
     def get_history_messages_excluding_current(self, current_user_query: str) -> List[SessionMessage]:
-        history = []
-        for msg in self._session.messages:
-            if msg.role == "user" and msg.content == current_user_query:
-                continue
-            history.append(msg)
+        # Callers consume whole SessionMessage objects, so the history is
+        # kept as an object list (a columnar split would have to rebuild
+        # every message on each read); the filter is a single comprehension.
+        history = [
+            msg for msg in self._session.messages
+            if msg.role != "user" or msg.content != current_user_query
+        ]
         logger.debug(f"Retrieved {len(history)} history messages (excluding current query)")
         return history
     
@@ -8,6 +8,7 @@
 import asyncio
 import json
 import base64
+from bisect import bisect_right
 from typing import AsyncGenerator, List, Dict, Any, Optional
 from datetime import datetime
 
@@ -22,40 +23,41 @@ class StreamProcessor:
         self.websocket_manager = websocket_manager
         self.active_streams: Dict[str, StreamSession] = {}
         
-    async def create_stream_session(self, stream_id: str, message_type: str = "warp.multi_agent.v1.Response") -> 'StreamSession':
+    # 纯字典操作的方法保持同步：不做任何 I/O，声明成 async 只会
+    # 为一次 dict 查找多付一轮事件循环调度。
+    def create_stream_session(self, stream_id: str, message_type: str = "warp.multi_agent.v1.Response") -> 'StreamSession':
         """创建流式会话"""
         session = StreamSession(stream_id, message_type, self.websocket_manager)
         self.active_streams[stream_id] = session
-        
+
         logger.info(f"创建流式会话: {stream_id}, 消息类型: {message_type}")
         return session
-    
-    async def get_stream_session(self, stream_id: str) -> Optional['StreamSession']:
+
+    def get_stream_session(self, stream_id: str) -> Optional['StreamSession']:
         """获取流式会话"""
         return self.active_streams.get(stream_id)
-    
+
     async def close_stream_session(self, stream_id: str):
         """关闭流式会话"""
-        if stream_id in self.active_streams:
-            session = self.active_streams[stream_id]
+        session = self.active_streams.pop(stream_id, None)
+        if session is not None:
             await session.close()
-            del self.active_streams[stream_id]
             logger.info(f"关闭流式会话: {stream_id}")
-    
+
     async def process_stream_chunk(self, stream_id: str, chunk_data: bytes) -> Dict[str, Any]:
         """处理流式数据块"""
-        session = await self.get_stream_session(stream_id)
+        session = self.get_stream_session(stream_id)
         if not session:
             raise ValueError(f"流式会话不存在: {stream_id}")
-        
+
         return await session.process_chunk(chunk_data)
-    
+
     async def finalize_stream(self, stream_id: str) -> Dict[str, Any]:
         """完成流式处理"""
-        session = await self.get_stream_session(stream_id)
+        session = self.get_stream_session(stream_id)
         if not session:
             raise ValueError(f"流式会话不存在: {stream_id}")
-        
+
         result = await session.finalize()
         await self.close_stream_session(stream_id)
         return result
@@ -69,54 +71,81 @@ class StreamSession:
         self.message_type = message_type
         self.websocket_manager = websocket_manager
         
-        self.chunks: List[bytes] = []
+        # 所有数据块直接追加进一个连续缓冲区，finalize 不再需要
+        # b''.join() 的整体拷贝；每块只记录 (偏移, 长度) 用于预览。
+        self._acc = bytearray()
+        self._chunk_spans: List[tuple] = []
         self.chunk_count = 0
         self.total_size = 0
         self.start_time = datetime.now()
         
         self.parsed_chunks: List[Dict] = []
         self.complete_message: Optional[Dict] = None
-        
+
+        # 10ms 窗口内的块事件合并成一帧广播，避免每个 token 一次
+        # 完整的事件循环往返。
+        self._pending: List[Dict] = []
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def _queue_broadcast(self, event: str, chunk_result: Dict) -> None:
+        """块事件入队，并在首个事件到达时调度一次延迟冲刷。"""
+        self._pending.append({"event": event, "chunk": chunk_result})
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self) -> None:
+        await asyncio.sleep(0.01)
+        await self._flush_pending()
+
+    async def _flush_pending(self) -> None:
+        self._flush_task = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        if self.websocket_manager:
+            await self.websocket_manager.broadcast({
+                "event": "stream_chunks_batch",
+                "stream_id": self.session_id,
+                "chunks": batch
+            })
+
     async def process_chunk(self, chunk_data: bytes) -> Dict[str, Any]:
         """处理单个数据块"""
         self.chunk_count += 1
         self.total_size += len(chunk_data)
-        self.chunks.append(chunk_data)
+        self._chunk_spans.append((len(self._acc), len(chunk_data)))
+        self._acc += chunk_data
         
         logger.debug(f"流式会话 {self.session_id}: 处理数据块 {self.chunk_count}, 大小 {len(chunk_data)} 字节")
         
+        if self.websocket_manager is None:
+            # 没有订阅者时逐块解析毫无收益，finalize 会统一解析完整消息；
+            # 时间戳只为广播帧服务，这里同样省掉。
+            return {
+                "chunk_index": self.chunk_count - 1,
+                "size": len(chunk_data)
+            }
+
         chunk_result = {
             "chunk_index": self.chunk_count - 1,
             "size": len(chunk_data),
             "timestamp": datetime.now().isoformat()
         }
-        
+
         try:
             chunk_json = protobuf_to_dict(chunk_data, self.message_type)
             chunk_result["json_data"] = chunk_json
             chunk_result["parsed_successfully"] = True
             
             self.parsed_chunks.append(chunk_json)
-            
-            if self.websocket_manager:
-                await self.websocket_manager.broadcast({
-                    "event": "stream_chunk_parsed",
-                    "stream_id": self.session_id,
-                    "chunk": chunk_result
-                })
-                
+            self._queue_broadcast("stream_chunk_parsed", chunk_result)
+
         except Exception as e:
             chunk_result["error"] = str(e)
             chunk_result["parsed_successfully"] = False
             logger.warning(f"数据块解析失败: {e}")
-            
-            if self.websocket_manager:
-                await self.websocket_manager.broadcast({
-                    "event": "stream_chunk_error", 
-                    "stream_id": self.session_id,
-                    "chunk": chunk_result
-                })
-        
+            self._queue_broadcast("stream_chunk_error", chunk_result)
+
         return chunk_result
     
     async def finalize(self) -> Dict[str, Any]:
@@ -133,31 +162,36 @@ class StreamSession:
             "chunks": []
         }
         
-        for i, chunk in enumerate(self.chunks):
+        acc = memoryview(self._acc)
+        for i, (off, ln) in enumerate(self._chunk_spans):
             chunk_info = {
                 "index": i,
-                "size": len(chunk),
-                "hex_preview": chunk[:32].hex() if len(chunk) >= 32 else chunk.hex()
+                "size": ln,
+                "hex_preview": bytes(acc[off:off + min(ln, 32)]).hex()
             }
-            
+
             if i < len(self.parsed_chunks):
                 chunk_info["parsed_data"] = self.parsed_chunks[i]
-            
+
             result["chunks"].append(chunk_info)
-        
+        acc.release()
+
         try:
-            complete_data = b''.join(self.chunks)
-            complete_json = protobuf_to_dict(complete_data, self.message_type)
-            
+            if self.chunk_count == 1 and self.parsed_chunks:
+                # 单块流在 process_chunk 已成功解析过，直接复用结果。
+                complete_json = self.parsed_chunks[0]
+            else:
+                complete_json = protobuf_to_dict(bytes(self._acc), self.message_type)
+
             result["complete_message"] = {
-                "size": len(complete_data),
+                "size": self.total_size,
                 "json_data": complete_json,
                 "assembly_successful": True
             }
-            
+
             self.complete_message = complete_json
-            
-            logger.info(f"流式消息拼接成功: {len(complete_data)} 字节")
+
+            logger.info(f"流式消息拼接成功: {self.total_size} 字节")
             
         except Exception as e:
             result["complete_message"] = {
@@ -167,17 +201,26 @@ class StreamSession:
             logger.warning(f"流式消息拼接失败: {e}")
         
         if self.websocket_manager:
+            # 先冲掉还在窗口内的块事件，保证事件顺序正确。
+            if self._flush_task is not None:
+                self._flush_task.cancel()
+            await self._flush_pending()
             await self.websocket_manager.broadcast({
                 "event": "stream_completed",
                 "stream_id": self.session_id,
                 "result": result
             })
-        
+
         return result
-    
+
     async def close(self):
         """关闭会话"""
-        self.chunks.clear()
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        self._pending.clear()
+        self._acc.clear()
+        self._chunk_spans.clear()
         self.parsed_chunks.clear()
         self.complete_message = None
         
@@ -199,19 +242,33 @@ class StreamPacketAnalyzer:
             "pattern_analysis": {}
         }
         
-        sizes = [len(chunk) for chunk in chunks]
+        # 一次遍历同时累计 min/max/total 和大小直方图，桶边界用
+        # bisect 定位，避免按区间反复扫描整个块列表。
+        bounds = (100, 500, 1000, 5000)
+        counts = [0, 0, 0, 0, 0]
+        lo = hi = len(chunks[0])
+        total = 0
+        for chunk in chunks:
+            size = len(chunk)
+            total += size
+            if size < lo:
+                lo = size
+            elif size > hi:
+                hi = size
+            counts[bisect_right(bounds, size)] += 1
         analysis["size_stats"] = {
-            "min": min(sizes),
-            "max": max(sizes),
-            "avg": sum(sizes) / len(sizes),
-            "total": sum(sizes)
+            "min": lo,
+            "max": hi,
+            "avg": total / len(chunks),
+            "total": total
+        }
+        analysis["size_distribution"] = {
+            "0-100": counts[0],
+            "100-500": counts[1],
+            "500-1000": counts[2],
+            "1000-5000": counts[3],
+            "5000-∞": counts[4]
         }
-        
-        size_ranges = [(0, 100), (100, 500), (500, 1000), (1000, 5000), (5000, float('inf'))]
-        for start, end in size_ranges:
-            range_name = f"{start}-{end if end != float('inf') else '∞'}"
-            count = sum(1 for size in sizes if start <= size < end)
-            analysis["size_distribution"][range_name] = count
         
         if len(chunks) >= 2:
             first_bytes = [chunk[:4].hex() if len(chunk) >= 4 else chunk.hex() for chunk in chunks[:5]]
@@ -239,14 +296,22 @@ class StreamPacketAnalyzer:
         
         deltas = []
         previous_content = ""
-        
+        # 所有增量在同一次调用里产出，时间戳取一次即可。
+        now = datetime.now().isoformat()
+        # 首块探测出文本路径后，后续块直接按该路径取值；只有取不到
+        # 时才回退重新探测（流中途换形状的情况极少）。
+        text_path = None
+
         for i, chunk in enumerate(parsed_chunks):
             delta = {
                 "chunk_index": i,
-                "timestamp": datetime.now().isoformat()
+                "timestamp": now
             }
-            
-            current_content = StreamPacketAnalyzer._extract_text_content(chunk)
+
+            if text_path is not None:
+                current_content = StreamPacketAnalyzer._walk_path(chunk, text_path)
+            if text_path is None or not isinstance(current_content, str):
+                current_content, text_path = StreamPacketAnalyzer._find_text_path(chunk)
             
             if current_content and current_content != previous_content:
                 if previous_content and current_content.startswith(previous_content):
@@ -269,55 +334,80 @@ class StreamPacketAnalyzer:
         
         return deltas
     
+    # 已知负载形状的候选文本路径；一条流内形状基本固定。
+    _TEXT_PATHS = (
+        ("content",),
+        ("text",),
+        ("message",),
+        ("agent_output", "text"),
+        ("choices", 0, "delta", "content"),
+        ("choices", 0, "message", "content")
+    )
+
+    @staticmethod
+    def _walk_path(data: Any, path: tuple) -> Any:
+        """按固定路径取值，任一跳不匹配返回 None。"""
+        current = data
+        for key in path:
+            if isinstance(current, dict):
+                current = current.get(key)
+            elif isinstance(current, list) and isinstance(key, int) and 0 <= key < len(current):
+                current = current[key]
+            else:
+                return None
+        return current
+
+    @staticmethod
+    def _find_text_path(data: Dict) -> tuple:
+        """探测文本所在路径，返回 (文本, 命中路径)；未命中为 ("", None)。"""
+        for path in StreamPacketAnalyzer._TEXT_PATHS:
+            v = StreamPacketAnalyzer._walk_path(data, path)
+            if isinstance(v, str):
+                return v, path
+        return "", None
+
     @staticmethod
     def _extract_text_content(data: Dict) -> str:
-        text_paths = [
-            ["content"],
-            ["text"],
-            ["message"],
-            ["agent_output", "text"],
-            ["choices", 0, "delta", "content"],
-            ["choices", 0, "message", "content"]
-        ]
-        
-        for path in text_paths:
-            try:
-                current = data
-                for key in path:
-                    if isinstance(current, dict) and key in current:
-                        current = current[key]
-                    elif isinstance(current, list) and isinstance(key, int) and 0 <= key < len(current):
-                        current = current[key]
-                    else:
-                        break
-                else:
-                    if isinstance(current, str):
-                        return current
-            except Exception:
-                continue
-        
+        # _walk_path 自身对每一跳做类型防护，永不抛异常，这里无需
+        # try/except 的帧开销。
+        for path in StreamPacketAnalyzer._TEXT_PATHS:
+            v = StreamPacketAnalyzer._walk_path(data, path)
+            if isinstance(v, str):
+                return v
         return ""
     
     @staticmethod
-    def _compare_dicts(dict1: Dict, dict2: Dict, prefix: str = "") -> List[str]:
-        changes = []
-        
+    def _compare_dicts(dict1: Dict, dict2: Dict, prefix: str = "",
+                       _changes: Optional[List[str]] = None) -> List[str]:
+        # 结果最多展示 10 条，累加器沿递归传递，凑满即停，避免对
+        # 已经确定会被截断的深层子树继续做整棵 != 深比较。
+        changes = _changes if _changes is not None else []
+        if len(changes) >= 10:
+            return changes
+
         all_keys = set(dict1.keys()) | set(dict2.keys())
-        
+
         for key in all_keys:
+            if len(changes) >= 10:
+                break
             current_path = f"{prefix}.{key}" if prefix else key
-            
+
             if key not in dict1:
                 changes.append(f"添加: {current_path}")
             elif key not in dict2:
                 changes.append(f"删除: {current_path}")
-            elif dict1[key] != dict2[key]:
-                if isinstance(dict1[key], dict) and isinstance(dict2[key], dict):
-                    changes.extend(StreamPacketAnalyzer._compare_dicts(dict1[key], dict2[key], current_path))
-                else:
+            else:
+                v1 = dict1[key]
+                v2 = dict2[key]
+                # 流式增量通常共享大部分子结构，同一对象直接跳过。
+                if v1 is v2:
+                    continue
+                if isinstance(v1, dict) and isinstance(v2, dict):
+                    StreamPacketAnalyzer._compare_dicts(v1, v2, current_path, changes)
+                elif v1 != v2:
                     changes.append(f"修改: {current_path}")
-        
-        return changes[:10]
+
+        return changes
 
 
 _global_processor: Optional[StreamProcessor] = None
@@ -5,233 +5,482 @@ Warp API客户端模块
 
 处理与Warp API的通信，包括protobuf数据发送和SSE响应解析。
 """
+import asyncio
 import httpx
+import logging
 import os
+import time
 import base64
 import binascii
-from typing import Optional, Any, Dict
+import traceback
+from collections import Counter, deque
+from typing import AsyncIterator, Callable, List, Optional, Any, Dict, Tuple
 from urllib.parse import urlparse
 import socket
 
 from ..core.logging import logger
 from ..core.protobuf_utils import protobuf_to_dict
 from ..core.auth import get_valid_jwt, acquire_anonymous_access_token
-from ..config.settings import WARP_URL as CONFIG_WARP_URL
+from ..config.settings import (
+    WARP_URL as CONFIG_WARP_URL,
+    CLIENT_VERSION,
+    OS_CATEGORY,
+    OS_NAME,
+    OS_VERSION,
+)
+
+try:
+    import brotli as _brotli  # httpx 的 br 解压依赖
+except ImportError:
+    _brotli = None
+
+# 不变的请求头只建一次，每次请求复制后仅补 authorization；
+# Content-Length 由 httpx 自行计算，无需手动设置。
+# accept-encoding 显式声明：SSE 里的 hex/base64 载荷可压缩 ~30-50%，
+# 服务端支持时 httpx 会透明解压；br 只在装了 brotli 时才声明，
+# 否则服务端按 br 压缩会解不出来。
+_BASE_HEADERS = {
+    "accept": "text/event-stream",
+    "accept-encoding": "gzip, deflate, br" if _brotli is not None else "gzip, deflate",
+    "content-type": "application/x-protobuf",
+    "x-warp-client-version": CLIENT_VERSION,
+    "x-warp-os-category": OS_CATEGORY,
+    "x-warp-os-name": OS_NAME,
+    "x-warp-os-version": OS_VERSION,
+}
+
+# base64 解码函数在模块级绑定一次；装有 pybase64（SIMD 实现）时优先，
+# 其 API 与标准库完全一致，缺失时退回标准库，行为不变。
+try:
+    from pybase64 import b64decode as _b64decode, urlsafe_b64decode as _urlsafe_b64decode
+except ImportError:
+    _b64decode = base64.b64decode
+    _urlsafe_b64decode = base64.urlsafe_b64decode
+
+_WS_BYTES = b" \t\n\r\x0b\x0c"
+
+
+def _dec_hex(s: bytes) -> bytes:
+    return binascii.a2b_hex(s)
+
+
+def _dec_b64url(s: bytes) -> bytes:
+    return _urlsafe_b64decode(s + b"=" * ((4 - (len(s) % 4)) % 4))
+
+
+def _dec_b64(s: bytes) -> bytes:
+    return _b64decode(s + b"=" * ((4 - (len(s) % 4)) % 4))
+
+
+# 级联顺序：hex 最常见，放最前（EAFP，字符集校验由解码器自己做）。
+_Decoder = Callable[[bytes], bytes]
+_DECODER_CASCADE: Tuple[_Decoder, ...] = (_dec_hex, _dec_b64url, _dec_b64)
+
+
+def _parse_payload_bytes(
+    data: Optional[bytes], hint: Optional[_Decoder] = None
+) -> Tuple[Optional[bytes], Optional[_Decoder]]:
+    """把 SSE data 载荷还原为原始字节（hex 或 base64/base64url）。
+
+    直接在 bytes 上工作，不经过 str 往返。返回 (payload, decoder)：
+    decoder 是本次成功的解码函数，调用方可在同一条流内作为 hint 传回
+    —— 服务端单条流内格式不变，命中 hint 就跳过整个级联；hint 失效
+    （极少数，如格式混用）时自动回退到完整级联重新探测。
+    """
+    s = data or b""
+    # SSE 框架层已剥掉行尾，载荷内几乎不含空白：先扫一遍（C 速度），
+    # 干净时零拷贝；命中才走 translate 删除（同样是 C 实现，免掉正则）。
+    if any(c in s for c in _WS_BYTES):
+        s = s.translate(None, _WS_BYTES)
+    if not s:
+        return None, hint
+    if hint is not None:
+        try:
+            return hint(s), hint
+        except Exception:
+            pass
+    for dec in _DECODER_CASCADE:
+        if dec is hint:
+            continue
+        try:
+            return dec(s), dec
+        except Exception:
+            continue
+    return None, None
+
+
+async def _iter_sse_lines(response: httpx.Response) -> AsyncIterator[bytes]:
+    """按 64KB 块读取响应并自行按换行分帧，产出去掉行尾 \\r 的 bytes 行。
+
+    载荷本身是 hex/base64 字节，aiter_lines 的 UTF-8 解码和通用换行
+    拆分对这种流只是白白多一遍内存拷贝。
+    """
+    buf = bytearray()
+    async for chunk in response.aiter_bytes(65536):
+        buf += chunk
+        while (nl := buf.find(b"\n")) != -1:
+            line = bytes(buf[:nl])
+            del buf[:nl + 1]
+            if line.endswith(b"\r"):
+                line = line[:-1]
+            yield line
+    if buf:
+        yield bytes(buf)
+
+
+# dict.get 永远不会返回这个哨兵，用它区分“键不存在”和“值为 None”，
+# 每个键一次哈希探测（`in` + 取值是两次）。
+_MISS = object()
 
 
 def _get(d: Dict[str, Any], *names: str) -> Any:
     """Return the first matching key value (camelCase/snake_case tolerant)."""
     for name in names:
-        if name in d:
-            return d[name]
+        v = d.get(name, _MISS)
+        if v is not _MISS:
+            return v
     return None
 
 
-def _get_event_type(event_data: dict) -> str:
-    """Determine the type of SSE event for logging"""
-    if "init" in event_data:
-        return "INITIALIZATION"
+try:
+    from orjson import dumps as _json_dumps  # C 实现，嵌套 dict 比 repr 快 5-10 倍
+except ImportError:
+    _json_dumps = None
+
+
+class _LazyJson:
+    """延迟序列化的日志参数：只有 handler 真正输出时才调 __str__。
+
+    配合 %-style 日志，DEBUG 关闭时零成本；开启时用 orjson（缺失则
+    退回 repr）序列化嵌套事件 dict。
+    """
+    __slots__ = ("o",)
+
+    def __init__(self, o):
+        self.o = o
+
+    def __str__(self) -> str:
+        if _json_dumps is not None:
+            try:
+                return _json_dumps(self.o).decode("utf-8")
+            except Exception:
+                pass
+        return repr(self.o)
+
+
+# Action-key → label table (both naming styles). One dict probe per key
+# replaces the 5-branch if/elif ladder of _get() calls per action.
+_ACTION_TYPE = {
+    "create_task": "CREATE_TASK",
+    "createTask": "CREATE_TASK",
+    "append_to_message_content": "APPEND_CONTENT",
+    "appendToMessageContent": "APPEND_CONTENT",
+    "add_messages_to_task": "ADD_MESSAGE",
+    "addMessagesToTask": "ADD_MESSAGE",
+    "tool_call": "TOOL_CALL",
+    "toolCall": "TOOL_CALL",
+    "tool_response": "TOOL_RESPONSE",
+    "toolResponse": "TOOL_RESPONSE",
+}
+
+
+def _classify_event(
+    event_data: Dict[str, Any]
+) -> Tuple[str, Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Classify an SSE event and pull out its payload in one walk.
+
+    Returns (event_type, init_data, actions): the logging label plus the
+    init dict and action list (empty when absent), so the stream loop
+    does not re-probe init/client_actions/actions after classification.
+    """
+    init_data = event_data.get("init")
     client_actions = _get(event_data, "client_actions", "clientActions")
+    actions: list = []
     if isinstance(client_actions, dict):
         actions = _get(client_actions, "actions", "Actions") or []
+
+    if init_data is not None:
+        return "INITIALIZATION", init_data, actions
+    if isinstance(client_actions, dict):
         if not actions:
-            return "CLIENT_ACTIONS_EMPTY"
-        
-        action_types = []
-        for action in actions:
-            if _get(action, "create_task", "createTask") is not None:
-                action_types.append("CREATE_TASK")
-            elif _get(action, "append_to_message_content", "appendToMessageContent") is not None:
-                action_types.append("APPEND_CONTENT")
-            elif _get(action, "add_messages_to_task", "addMessagesToTask") is not None:
-                action_types.append("ADD_MESSAGE")
-            elif _get(action, "tool_call", "toolCall") is not None:
-                action_types.append("TOOL_CALL")
-            elif _get(action, "tool_response", "toolResponse") is not None:
-                action_types.append("TOOL_RESPONSE")
-            else:
-                action_types.append("UNKNOWN_ACTION")
-        
-        return f"CLIENT_ACTIONS({', '.join(action_types)})"
-    elif "finished" in event_data:
-        return "FINISHED"
-    else:
-        return "UNKNOWN_EVENT"
+            return "CLIENT_ACTIONS_EMPTY", None, actions
+        # Actions carry few keys, so scanning the action beats probing it
+        # with every known key.
+        action_types = [
+            next((_ACTION_TYPE[k] for k in action if k in _ACTION_TYPE),
+                 "UNKNOWN_ACTION")
+            for action in actions
+        ]
+        return f"CLIENT_ACTIONS({', '.join(action_types)})", None, actions
+    if "finished" in event_data:
+        return "FINISHED", None, actions
+    return "UNKNOWN_EVENT", None, actions
 
 
-async def send_protobuf_to_warp_api(
-    protobuf_bytes: bytes, show_all_events: bool = True
-) -> tuple[str, Optional[str], Optional[str]]:
-    """发送protobuf数据到Warp API并获取响应"""
+# 模块级共享的 httpx 客户端：连接池 + HTTP/2 多路复用，省掉每次
+# 请求重建 TCP/TLS 的 1-2 个 RTT。与 core.auth 的 _get_http 同一模式。
+_CLIENT: Optional[httpx.AsyncClient] = None
+_CLIENT_LOCK = asyncio.Lock()
+
+
+async def _get_client() -> httpx.AsyncClient:
+    global _CLIENT
+    if _CLIENT is None:
+        async with _CLIENT_LOCK:
+            if _CLIENT is None:
+                verify_opt = True
+                insecure_env = os.getenv("WARP_INSECURE_TLS", "").lower()
+                if insecure_env in ("1", "true", "yes"):
+                    verify_opt = False
+                    logger.warning("TLS verification disabled via WARP_INSECURE_TLS for Warp API client")
+                _CLIENT = httpx.AsyncClient(
+                    http2=True,
+                    timeout=httpx.Timeout(60.0),
+                    verify=verify_opt,
+                    trust_env=True,
+                    limits=httpx.Limits(max_keepalive_connections=32),
+                )
+    return _CLIENT
+
+
+async def close_warp_client() -> None:
+    """Close the shared client; called from the server lifespan on shutdown."""
+    global _CLIENT
+    if _CLIENT is not None:
+        try:
+            await _CLIENT.aclose()
+        finally:
+            _CLIENT = None
+
+
+# 文本合并阈值：纯追加事件的碎片攒到 512 字符或 20ms 后一次产出，
+# 减少跨异步边界的 yield 次数和下游的小写操作。
+_COALESCE_MAX_CHARS = 512
+_COALESCE_MAX_DELAY = 0.02
+
+
+async def stream_warp_events(
+    protobuf_bytes: bytes, show_all_events: bool = True,
+    coalesce_text: bool = True,
+) -> AsyncIterator[Dict[str, Any]]:
+    """发送protobuf数据，逐事件产出解析结果（异步生成器）。
+
+    每个产出的 dict 形如::
+
+        {"event_number": int, "event_type": str, "parsed_data": dict,
+         "text": Optional[str], "conversation_id": ..., "task_id": ...}
+
+    text 是该事件内提取到的全部文本片段（无则为 None）；
+    conversation_id / task_id 是截至该事件的最新已知值。事件到达即
+    产出，调用方不必等整条流结束——首文本延迟即首事件延迟，内存
+    占用也与响应总长解耦。HTTP 层错误以
+    {"event_type": "HTTP_ERROR", "error": 错误字符串} 的事件产出。
+
+    coalesce_text=True（默认）时，只含文本追加的连续小事件会被合并，
+    攒满阈值后以 {"event_type": "TEXT", "parsed_data": None} 的合成
+    事件产出（文本顺序不变，其余事件类型照常逐个产出）；需要每个
+    事件的 parsed_data 时传 False。
+    """
     try:
         logger.info(f"发送 {len(protobuf_bytes)} 字节到Warp API")
         logger.info(f"数据包前32字节 (hex): {protobuf_bytes[:32].hex()}")
-        
+
         warp_url = CONFIG_WARP_URL
-        
+
         logger.info(f"发送请求到: {warp_url}")
-        
+
         conversation_id = None
         task_id = None
-        complete_response = []
-        all_events = []
         event_count = 0
-        
-        verify_opt = True
-        insecure_env = os.getenv("WARP_INSECURE_TLS", "").lower()
-        if insecure_env in ("1", "true", "yes"):
-            verify_opt = False
-            logger.warning("TLS verification disabled via WARP_INSECURE_TLS for Warp API client")
-
-        async with httpx.AsyncClient(http2=True, timeout=httpx.Timeout(60.0), verify=verify_opt, trust_env=True) as client:
-            # 最多尝试两次：第一次失败且为配额429时申请匿名token并重试一次
-            for attempt in range(2):
-                jwt = await get_valid_jwt() if attempt == 0 else jwt  # keep existing unless refreshed explicitly
-                headers = {
-                    "accept": "text/event-stream",
-                    "content-type": "application/x-protobuf", 
-                    "x-warp-client-version": "v0.2025.08.06.08.12.stable_02",
-                    "x-warp-os-category": "Windows",
-                    "x-warp-os-name": "Windows", 
-                    "x-warp-os-version": "11 (26100)",
-                    "authorization": f"Bearer {jwt}",
-                    "content-length": str(len(protobuf_bytes)),
-                }
-                async with client.stream("POST", warp_url, headers=headers, content=protobuf_bytes) as response:
-                    if response.status_code != 200:
-                        error_text = await response.aread()
-                        error_content = error_text.decode('utf-8') if error_text else "No error content"
-                        # 检测配额耗尽错误并在第一次失败时尝试申请匿名token
-                        if response.status_code == 429 and attempt == 0 and (
-                            ("No remaining quota" in error_content) or ("No AI requests remaining" in error_content)
-                        ):
-                            logger.warning("WARP API 返回 429 (配额用尽)。尝试申请匿名token并重试一次…")
-                            try:
-                                new_jwt = await acquire_anonymous_access_token()
-                            except Exception:
-                                new_jwt = None
-                            if new_jwt:
-                                jwt = new_jwt
-                                # 跳出当前响应并进行下一次尝试
-                                continue
-                            else:
-                                logger.error("匿名token申请失败，无法重试。")
-                                logger.error(f"WARP API HTTP ERROR {response.status_code}: {error_content}")
-                                return f"❌ Warp API Error (HTTP {response.status_code}): {error_content}", None, None
-                        # 其他错误或第二次失败
-                        logger.error(f"WARP API HTTP ERROR {response.status_code}: {error_content}")
-                        return f"❌ Warp API Error (HTTP {response.status_code}): {error_content}", None, None
-                    
-                    logger.info(f"✅ 收到HTTP {response.status_code}响应")
-                    logger.info("开始处理SSE事件流...")
-                    
-                    import re as _re
-                    def _parse_payload_bytes(data_str: str):
-                        s = _re.sub(r"\s+", "", data_str or "")
-                        if not s:
-                            return None
-                        if _re.fullmatch(r"[0-9a-fA-F]+", s or ""):
-                            try:
-                                return bytes.fromhex(s)
-                            except Exception:
-                                pass
-                        pad = "=" * ((4 - (len(s) % 4)) % 4)
+        event_type_counts: Counter = Counter()
+        # 逐事件日志只在 DEBUG 级别输出；级别判断在循环外取一次，
+        # 避免每个事件为注定丢弃的日志做 str(dict) 格式化。
+        debug_events = logger.isEnabledFor(logging.DEBUG)
+
+        client = await _get_client()
+        # 最多尝试两次：第一次失败且为配额429时申请匿名token并重试一次
+        for attempt in range(2):
+            jwt = await get_valid_jwt() if attempt == 0 else jwt  # keep existing unless refreshed explicitly
+            headers = dict(_BASE_HEADERS)
+            headers["authorization"] = f"Bearer {jwt}"
+            async with client.stream("POST", warp_url, headers=headers, content=protobuf_bytes) as response:
+                if response.status_code != 200:
+                    error_text = await response.aread()
+                    error_content = error_text.decode('utf-8') if error_text else "No error content"
+                    # 检测配额耗尽错误并在第一次失败时尝试申请匿名token
+                    if response.status_code == 429 and attempt == 0 and (
+                        ("No remaining quota" in error_content) or ("No AI requests remaining" in error_content)
+                    ):
+                        logger.warning("WARP API 返回 429 (配额用尽)。尝试申请匿名token并重试一次…")
                         try:
-                            import base64 as _b64
-                            return _b64.urlsafe_b64decode(s + pad)
+                            new_jwt = await acquire_anonymous_access_token()
                         except Exception:
-                            try:
-                                return _b64.b64decode(s + pad)
-                            except Exception:
-                                return None
-                    
-                    current_data = ""
-                    
-                    async for line in response.aiter_lines():
-                        if line.startswith("data:"):
-                            payload = line[5:].strip()
-                            if not payload:
-                                continue
-                            if payload == "[DONE]":
-                                logger.info("收到[DONE]标记，结束处理")
-                                break
-                            current_data += payload
+                            new_jwt = None
+                        if new_jwt:
+                            jwt = new_jwt
+                            # 跳出当前响应并进行下一次尝试
                             continue
-                        
-                        if (line.strip() == "") and current_data:
-                            raw_bytes = _parse_payload_bytes(current_data)
-                            current_data = ""
-                            if raw_bytes is None:
-                                logger.debug("跳过无法解析的SSE数据块（非hex/base64或不完整）")
-                                continue
-                            try:
-                                event_data = protobuf_to_dict(raw_bytes, "warp.multi_agent.v1.ResponseEvent")
-                            except Exception as parse_error:
-                                logger.debug(f"解析事件失败，跳过: {str(parse_error)[:100]}")
-                                continue
-                            event_count += 1
-                            
-                            def _get(d: Dict[str, Any], *names: str) -> Any:
-                                for n in names:
-                                    if isinstance(d, dict) and n in d:
-                                        return d[n]
-                                return None
-                            
-                            event_type = _get_event_type(event_data)
-                            if show_all_events:
-                                all_events.append({"event_number": event_count, "event_type": event_type, "raw_data": event_data})
-                            logger.info(f"🔄 Event #{event_count}: {event_type}")
+                        logger.error("匿名token申请失败，无法重试。")
+                    # 其他错误或第二次失败
+                    logger.error(f"WARP API HTTP ERROR {response.status_code}: {error_content}")
+                    yield {
+                        "event_number": 0,
+                        "event_type": "HTTP_ERROR",
+                        "parsed_data": None,
+                        "text": None,
+                        "conversation_id": None,
+                        "task_id": None,
+                        "error": f"❌ Warp API Error (HTTP {response.status_code}): {error_content}",
+                    }
+                    return
+
+                logger.info(f"✅ 收到HTTP {response.status_code}响应")
+                logger.info("开始处理SSE事件流...")
+
+                # 同一事件的多个 data: 片段先收集，空行边界处一次 join，
+                # 避免大载荷上 += 的二次方级字符串重分配。
+                data_parts: list = []
+                # 首个事件探测出的解码格式（hex / base64url / base64），
+                # 同一条流内复用，后续事件跳过级联试错。
+                payload_decoder = None
+                # 待合并的文本碎片（仅 coalesce_text 时累积）
+                pending_texts: list = []
+                pending_chars = 0
+                last_flush = time.monotonic()
+
+                async for line in _iter_sse_lines(response):
+                    if line.startswith(b"data:"):
+                        payload = line[5:].strip()
+                        if not payload:
+                            continue
+                        if payload == b"[DONE]":
+                            logger.info("收到[DONE]标记，结束处理")
+                            break
+                        data_parts.append(payload)
+                        continue
+
+                    if (not line.strip()) and data_parts:
+                        raw_bytes, payload_decoder = _parse_payload_bytes(
+                            b"".join(data_parts), payload_decoder)
+                        data_parts.clear()
+                        if raw_bytes is None:
+                            logger.debug("跳过无法解析的SSE数据块（非hex/base64或不完整）")
+                            continue
+                        try:
+                            event_data = protobuf_to_dict(raw_bytes, "warp.multi_agent.v1.ResponseEvent")
+                        except Exception as parse_error:
+                            logger.debug(f"解析事件失败，跳过: {str(parse_error)[:100]}")
+                            continue
+                        event_count += 1
+
+                        event_type, init_data, actions = _classify_event(event_data)
+                        event_type_counts[event_type] += 1
+                        if debug_events:
+                            logger.debug("🔄 Event #%d: %s", event_count, event_type)
                             if show_all_events:
-                                logger.info(f"   📋 Event data: {str(event_data)}...")
-                            
-                            if "init" in event_data:
-                                init_data = event_data["init"]
-                                conversation_id = init_data.get("conversation_id", conversation_id)
-                                task_id = init_data.get("task_id", task_id)
-                                logger.info(f"会话初始化: {conversation_id}")
-                                client_actions = _get(event_data, "client_actions", "clientActions")
-                                if isinstance(client_actions, dict):
-                                    actions = _get(client_actions, "actions", "Actions") or []
-                                    for i, action in enumerate(actions):
-                                        logger.info(f"   🎯 Action #{i+1}: {list(action.keys())}")
-                                        append_data = _get(action, "append_to_message_content", "appendToMessageContent")
-                                        if isinstance(append_data, dict):
-                                            message = append_data.get("message", {})
-                                            agent_output = _get(message, "agent_output", "agentOutput") or {}
-                                            text_content = agent_output.get("text", "")
-                                            if text_content:
-                                                complete_response.append(text_content)
-                                                logger.info(f"   📝 Text Fragment: {text_content[:100]}...")
-                                        messages_data = _get(action, "add_messages_to_task", "addMessagesToTask")
-                                        if isinstance(messages_data, dict):
-                                            messages = messages_data.get("messages", [])
-                                            task_id = messages_data.get("task_id", messages_data.get("taskId", task_id))
-                                            for j, message in enumerate(messages):
-                                                logger.info(f"   📨 Message #{j+1}: {list(message.keys())}")
-                                                if _get(message, "agent_output", "agentOutput") is not None:
-                                                    agent_output = _get(message, "agent_output", "agentOutput") or {}
-                                                    text_content = agent_output.get("text", "")
-                                                    if text_content:
-                                                        complete_response.append(text_content)
-                                                        logger.info(f"   📝 Complete Message: {text_content[:100]}...")
-                    
-                    full_response = "".join(complete_response)
-                    logger.info("="*60)
-                    logger.info("📊 SSE STREAM SUMMARY")
-                    logger.info("="*60)
-                    logger.info(f"📈 Total Events Processed: {event_count}")
-                    logger.info(f"🆔 Conversation ID: {conversation_id}")
-                    logger.info(f"🆔 Task ID: {task_id}")
-                    logger.info(f"📝 Response Length: {len(full_response)} characters")
-                    logger.info("="*60)
-                    if full_response:
-                        logger.info(f"✅ Stream processing completed successfully")
-                        return full_response, conversation_id, task_id
-                    else:
-                        logger.warning("⚠️ No text content received in response")
-                        return "Warning: No response content received", conversation_id, task_id
+                                logger.debug("   📋 Event data: %s", _LazyJson(event_data))
+
+                        if init_data is not None:
+                            conversation_id = init_data.get("conversation_id", conversation_id)
+                            task_id = init_data.get("task_id", task_id)
+                            logger.info(f"会话初始化: {conversation_id}")
+
+                        texts: list = []
+                        for i, action in enumerate(actions):
+                            if debug_events:
+                                logger.debug("   🎯 Action #%d: %s", i + 1, list(action.keys()))
+                            append_data = _get(action, "append_to_message_content", "appendToMessageContent")
+                            if isinstance(append_data, dict):
+                                message = append_data.get("message", {})
+                                agent_output = _get(message, "agent_output", "agentOutput") or {}
+                                text_content = agent_output.get("text", "")
+                                if text_content:
+                                    texts.append(text_content)
+                                    if debug_events:
+                                        logger.debug("   📝 Text Fragment: %.100s...", text_content)
+                            messages_data = _get(action, "add_messages_to_task", "addMessagesToTask")
+                            if isinstance(messages_data, dict):
+                                messages = messages_data.get("messages", [])
+                                task_id = messages_data.get("task_id", messages_data.get("taskId", task_id))
+                                for j, message in enumerate(messages):
+                                    if debug_events:
+                                        logger.debug("   📨 Message #%d: %s", j + 1, list(message.keys()))
+                                    agent_output = _get(message, "agent_output", "agentOutput")
+                                    if agent_output is not None:
+                                        text_content = agent_output.get("text", "")
+                                        if text_content:
+                                            texts.append(text_content)
+                                            if debug_events:
+                                                logger.debug("   📝 Complete Message: %.100s...", text_content)
+
+                        if coalesce_text and texts and init_data is None and all(
+                            next((_ACTION_TYPE[k] for k in a if k in _ACTION_TYPE), None) == "APPEND_CONTENT"
+                            for a in actions
+                        ):
+                            # 纯文本追加事件：先攒着，满阈值再合并产出
+                            pending_texts.extend(texts)
+                            pending_chars += sum(len(t) for t in texts)
+                            now = time.monotonic()
+                            if pending_chars >= _COALESCE_MAX_CHARS or (now - last_flush) >= _COALESCE_MAX_DELAY:
+                                yield {
+                                    "event_number": event_count,
+                                    "event_type": "TEXT",
+                                    "parsed_data": None,
+                                    "text": "".join(pending_texts),
+                                    "conversation_id": conversation_id,
+                                    "task_id": task_id,
+                                }
+                                pending_texts.clear()
+                                pending_chars = 0
+                                last_flush = now
+                            continue
+
+                        # 非纯追加事件：先冲掉待合并文本，保持顺序
+                        if pending_texts:
+                            yield {
+                                "event_number": event_count,
+                                "event_type": "TEXT",
+                                "parsed_data": None,
+                                "text": "".join(pending_texts),
+                                "conversation_id": conversation_id,
+                                "task_id": task_id,
+                            }
+                            pending_texts.clear()
+                            pending_chars = 0
+                            last_flush = time.monotonic()
+
+                        yield {
+                            "event_number": event_count,
+                            "event_type": event_type,
+                            "parsed_data": event_data,
+                            "text": "".join(texts) if texts else None,
+                            "conversation_id": conversation_id,
+                            "task_id": task_id,
+                        }
+
+                if pending_texts:
+                    yield {
+                        "event_number": event_count,
+                        "event_type": "TEXT",
+                        "parsed_data": None,
+                        "text": "".join(pending_texts),
+                        "conversation_id": conversation_id,
+                        "task_id": task_id,
+                    }
+                    pending_texts.clear()
+                    pending_chars = 0
+
+                logger.info("="*60)
+                logger.info("📊 SSE STREAM SUMMARY")
+                logger.info("="*60)
+                logger.info(f"📈 Total Events Processed: {event_count}")
+                if event_type_counts:
+                    logger.info("🧮 Event Types: %s", dict(event_type_counts))
+                logger.info(f"🆔 Conversation ID: {conversation_id}")
+                logger.info(f"🆔 Task ID: {task_id}")
+                logger.info("="*60)
+                return
     except Exception as e:
-        import traceback
         logger.error("="*60)
         logger.error("WARP API CLIENT EXCEPTION")
         logger.error("="*60)
@@ -245,182 +494,71 @@ async def send_protobuf_to_warp_api(
         raise
 
 
+# 缓冲包装的内存上限：异常长（或恶意）的流只会顶掉最旧的已解析
+# 事件、截断聚合文本，而不是无限增长；流式消费方不受这些上限影响。
+MAX_PARSED_EVENTS = int(os.getenv("WARP_MAX_PARSED_EVENTS", "10000"))
+MAX_RESPONSE_CHARS = int(os.getenv("WARP_MAX_RESPONSE_CHARS", str(8 * 1024 * 1024)))
+
+
+async def _stream_warp(
+    protobuf_bytes: bytes, collect_parsed: bool, show_all_events: bool = True
+) -> tuple[str, Optional[str], Optional[str], list]:
+    """缓冲包装：消费 stream_warp_events 并聚合成一次性返回值。
+
+    需要增量结果的调用方直接迭代 stream_warp_events 即可。
+    """
+    conversation_id = None
+    task_id = None
+    complete_response: list = []
+    response_chars = 0
+    parsed_events: deque = deque(maxlen=MAX_PARSED_EVENTS)
+    # 关闭合并：聚合路径需要每个事件的 parsed_data 原样入列
+    async for ev in stream_warp_events(
+        protobuf_bytes, show_all_events=show_all_events, coalesce_text=False
+    ):
+        if ev["event_type"] == "HTTP_ERROR":
+            return ev["error"], None, None, []
+        conversation_id = ev["conversation_id"]
+        task_id = ev["task_id"]
+        text = ev["text"]
+        if text and response_chars < MAX_RESPONSE_CHARS:
+            complete_response.append(text)
+            response_chars += len(text)
+            if response_chars >= MAX_RESPONSE_CHARS:
+                logger.warning(
+                    f"响应文本超过 {MAX_RESPONSE_CHARS} 字符上限，后续文本被丢弃"
+                )
+        if collect_parsed:
+            parsed_events.append({
+                "event_number": ev["event_number"],
+                "event_type": ev["event_type"],
+                "parsed_data": ev["parsed_data"],
+            })
+    full_response = "".join(complete_response)
+    logger.info(f"📝 Response Length: {len(full_response)} characters")
+    if collect_parsed:
+        logger.info(f"🎯 Parsed Events Count: {len(parsed_events)}")
+    return full_response, conversation_id, task_id, list(parsed_events)
+
+
+async def send_protobuf_to_warp_api(
+    protobuf_bytes: bytes, show_all_events: bool = True
+) -> tuple[str, Optional[str], Optional[str]]:
+    """发送protobuf数据到Warp API并获取响应"""
+    full_response, conversation_id, task_id, _ = await _stream_warp(
+        protobuf_bytes, collect_parsed=False, show_all_events=show_all_events
+    )
+    if full_response:
+        logger.info("✅ Stream processing completed successfully")
+        return full_response, conversation_id, task_id
+    logger.warning("⚠️ No text content received in response")
+    return "Warning: No response content received", conversation_id, task_id
+
+
 async def send_protobuf_to_warp_api_parsed(protobuf_bytes: bytes) -> tuple[str, Optional[str], Optional[str], list]:
     """发送protobuf数据到Warp API并获取解析后的SSE事件数据"""
-    try:
-        logger.info(f"发送 {len(protobuf_bytes)} 字节到Warp API (解析模式)")
-        logger.info(f"数据包前32字节 (hex): {protobuf_bytes[:32].hex()}")
-        
-        warp_url = CONFIG_WARP_URL
-        
-        logger.info(f"发送请求到: {warp_url}")
-        
-        conversation_id = None
-        task_id = None
-        complete_response = []
-        parsed_events = []
-        event_count = 0
-        
-        verify_opt = True
-        insecure_env = os.getenv("WARP_INSECURE_TLS", "").lower()
-        if insecure_env in ("1", "true", "yes"):
-            verify_opt = False
-            logger.warning("TLS verification disabled via WARP_INSECURE_TLS for Warp API client")
-
-        async with httpx.AsyncClient(http2=True, timeout=httpx.Timeout(60.0), verify=verify_opt, trust_env=True) as client:
-            # 最多尝试两次：第一次失败且为配额429时申请匿名token并重试一次
-            for attempt in range(2):
-                jwt = await get_valid_jwt() if attempt == 0 else jwt  # keep existing unless refreshed explicitly
-                headers = {
-                    "accept": "text/event-stream",
-                    "content-type": "application/x-protobuf", 
-                    "x-warp-client-version": "v0.2025.08.06.08.12.stable_02",
-                    "x-warp-os-category": "Windows",
-                    "x-warp-os-name": "Windows", 
-                    "x-warp-os-version": "11 (26100)",
-                    "authorization": f"Bearer {jwt}",
-                    "content-length": str(len(protobuf_bytes)),
-                }
-                async with client.stream("POST", warp_url, headers=headers, content=protobuf_bytes) as response:
-                    if response.status_code != 200:
-                        error_text = await response.aread()
-                        error_content = error_text.decode('utf-8') if error_text else "No error content"
-                        # 检测配额耗尽错误并在第一次失败时尝试申请匿名token
-                        if response.status_code == 429 and attempt == 0 and (
-                            ("No remaining quota" in error_content) or ("No AI requests remaining" in error_content)
-                        ):
-                            logger.warning("WARP API 返回 429 (配额用尽, 解析模式)。尝试申请匿名token并重试一次…")
-                            try:
-                                new_jwt = await acquire_anonymous_access_token()
-                            except Exception:
-                                new_jwt = None
-                            if new_jwt:
-                                jwt = new_jwt
-                                # 跳出当前响应并进行下一次尝试
-                                continue
-                            else:
-                                logger.error("匿名token申请失败，无法重试 (解析模式)。")
-                                logger.error(f"WARP API HTTP ERROR (解析模式) {response.status_code}: {error_content}")
-                                return f"❌ Warp API Error (HTTP {response.status_code}): {error_content}", None, None, []
-                        # 其他错误或第二次失败
-                        logger.error(f"WARP API HTTP ERROR (解析模式) {response.status_code}: {error_content}")
-                        return f"❌ Warp API Error (HTTP {response.status_code}): {error_content}", None, None, []
-                    
-                    logger.info(f"✅ 收到HTTP {response.status_code}响应 (解析模式)")
-                    logger.info("开始处理SSE事件流...")
-                    
-                    import re as _re2
-                    def _parse_payload_bytes2(data_str: str):
-                        s = _re2.sub(r"\s+", "", data_str or "")
-                        if not s:
-                            return None
-                        if _re2.fullmatch(r"[0-9a-fA-F]+", s or ""):
-                            try:
-                                return bytes.fromhex(s)
-                            except Exception:
-                                pass
-                        pad = "=" * ((4 - (len(s) % 4)) % 4)
-                        try:
-                            import base64 as _b642
-                            return _b642.urlsafe_b64decode(s + pad)
-                        except Exception:
-                            try:
-                                return _b642.b64decode(s + pad)
-                            except Exception:
-                                return None
-                    
-                    current_data = ""
-                    
-                    async for line in response.aiter_lines():
-                        if line.startswith("data:"):
-                            payload = line[5:].strip()
-                            if not payload:
-                                continue
-                            if payload == "[DONE]":
-                                logger.info("收到[DONE]标记，结束处理")
-                                break
-                            current_data += payload
-                            continue
-                        
-                        if (line.strip() == "") and current_data:
-                            raw_bytes = _parse_payload_bytes2(current_data)
-                            current_data = ""
-                            if raw_bytes is None:
-                                logger.debug("跳过无法解析的SSE数据块（非hex/base64或不完整）")
-                                continue
-                            try:
-                                event_data = protobuf_to_dict(raw_bytes, "warp.multi_agent.v1.ResponseEvent")
-                                event_count += 1
-                                event_type = _get_event_type(event_data)
-                                parsed_event = {"event_number": event_count, "event_type": event_type, "parsed_data": event_data}
-                                parsed_events.append(parsed_event)
-                                logger.info(f"🔄 Event #{event_count}: {event_type}")
-                                logger.debug(f"   📋 Event data: {str(event_data)}...")
-                                
-                                def _get(d: Dict[str, Any], *names: str) -> Any:
-                                    for n in names:
-                                        if isinstance(d, dict) and n in d:
-                                            return d[n]
-                                    return None
-                                
-                                if "init" in event_data:
-                                    init_data = event_data["init"]
-                                    conversation_id = init_data.get("conversation_id", conversation_id)
-                                    task_id = init_data.get("task_id", task_id)
-                                    logger.info(f"会话初始化: {conversation_id}")
-                                
-                                client_actions = _get(event_data, "client_actions", "clientActions")
-                                if isinstance(client_actions, dict):
-                                    actions = _get(client_actions, "actions", "Actions") or []
-                                    for i, action in enumerate(actions):
-                                        logger.info(f"   🎯 Action #{i+1}: {list(action.keys())}")
-                                        append_data = _get(action, "append_to_message_content", "appendToMessageContent")
-                                        if isinstance(append_data, dict):
-                                            message = append_data.get("message", {})
-                                            agent_output = _get(message, "agent_output", "agentOutput") or {}
-                                            text_content = agent_output.get("text", "")
-                                            if text_content:
-                                                complete_response.append(text_content)
-                                                logger.info(f"   📝 Text Fragment: {text_content[:100]}...")
-                                        messages_data = _get(action, "add_messages_to_task", "addMessagesToTask")
-                                        if isinstance(messages_data, dict):
-                                            messages = messages_data.get("messages", [])
-                                            task_id = messages_data.get("task_id", messages_data.get("taskId", task_id))
-                                            for j, message in enumerate(messages):
-                                                logger.info(f"   📨 Message #{j+1}: {list(message.keys())}")
-                                                if _get(message, "agent_output", "agentOutput") is not None:
-                                                    agent_output = _get(message, "agent_output", "agentOutput") or {}
-                                                    text_content = agent_output.get("text", "")
-                                                    if text_content:
-                                                        complete_response.append(text_content)
-                                                        logger.info(f"   📝 Complete Message: {text_content[:100]}...")
-                            except Exception as parse_err:
-                                logger.debug(f"解析事件失败，跳过: {str(parse_err)[:100]}")
-                                continue
-                    
-                    full_response = "".join(complete_response)
-                    logger.info("="*60)
-                    logger.info("📊 SSE STREAM SUMMARY (解析模式)")
-                    logger.info("="*60)
-                    logger.info(f"📈 Total Events Processed: {event_count}")
-                    logger.info(f"🆔 Conversation ID: {conversation_id}")
-                    logger.info(f"🆔 Task ID: {task_id}")
-                    logger.info(f"📝 Response Length: {len(full_response)} characters")
-                    logger.info(f"🎯 Parsed Events Count: {len(parsed_events)}")
-                    logger.info("="*60)
-                    
-                    logger.info(f"✅ Stream processing completed successfully (解析模式)")
-                    return full_response, conversation_id, task_id, parsed_events
-    except Exception as e:
-        import traceback
-        logger.error("="*60)
-        logger.error("WARP API CLIENT EXCEPTION (解析模式)")
-        logger.error("="*60)
-        logger.error(f"Exception Type: {type(e).__name__}")
-        logger.error(f"Exception Message: {str(e)}")
-        logger.error(f"Request URL: {warp_url if 'warp_url' in locals() else 'Unknown'}")
-        logger.error(f"Request Size: {len(protobuf_bytes) if 'protobuf_bytes' in locals() else 'Unknown'}")
-        logger.error("Python Traceback:")
-        logger.error(traceback.format_exc())
-        logger.error("="*60)
-        raise
\ No newline at end of file
+    full_response, conversation_id, task_id, parsed_events = await _stream_warp(
+        protobuf_bytes, collect_parsed=True
+    )
+    logger.info("✅ Stream processing completed successfully (解析模式)")
+    return full_response, conversation_id, task_id, parsed_events
@@ -5,200 +5,372 @@ Warp API response parsing
 
 Handles parsing of protobuf responses and extraction of OpenAI-compatible content.
 """
-from typing import Optional, Dict, List, Any
+import functools
+import logging
+import threading
+from json import dumps as _json_dumps
+from typing import Iterator, Optional, Dict, List, Any, Tuple
+
+try:
+    from orjson import dumps as _orjson_dumps  # C serializer, faster on dict/str payloads
+except ImportError:
+    _orjson_dumps = None
+
+
+def _dumps_args(obj: Any) -> str:
+    """Serialize tool arguments; repeated proto containers pass through
+    default=list so they are converted during encoding instead of being
+    copied into lists up front."""
+    if _orjson_dumps is not None:
+        try:
+            return _orjson_dumps(obj, default=list).decode("utf-8")
+        except Exception:
+            pass
+    return _json_dumps(obj, default=list)
+
 
 from ..core.logging import logger
 from ..core.protobuf import ensure_proto_runtime, msg_cls
 
 
-def extract_openai_content_from_response(payload: bytes) -> dict:
+@functools.lru_cache(maxsize=None)
+def _response_event_cls():
+    """Resolve the ResponseEvent class once; every payload reuses it.
+
+    Lazy (rather than at import) so the proto runtime is only built when
+    a response is actually parsed.
+    """
+    ensure_proto_runtime()
+    return msg_cls("warp.multi_agent.v1.ResponseEvent")
+
+
+@functools.lru_cache(maxsize=None)
+def _empty_finished_frame() -> bytes:
+    """Wire bytes of a ResponseEvent holding only an empty `finished`.
+
+    Streams end with (and heartbeat on) this exact two-byte frame, so
+    the extractors compare against it before paying for a full protobuf
+    parse. The tag byte comes from the descriptor rather than being
+    hardcoded; field numbers below 16 always fit in one byte.
+    """
+    field = _response_event_cls().DESCRIPTOR.fields_by_name["finished"]
+    return bytes(((field.number << 3) | 2, 0))  # tag (wire type 2) + length 0
+
+
+_TLS = threading.local()
+
+
+def _reusable_response() -> Any:
+    """Thread-local ResponseEvent reused across eager extractions.
+
+    Clear()+reparse skips the per-call message construction. Only the
+    extractors that finish with the message before returning use this;
+    the SSE delta generator allocates a fresh instance because it is
+    consumed lazily and two interleaved iterations on the same thread
+    would otherwise clobber each other's state.
+    """
+    resp = getattr(_TLS, "resp", None)
+    if resp is None:
+        resp = _response_event_cls()()
+        _TLS.resp = resp
+    else:
+        resp.Clear()
+    return resp
+
+
+# Per-action-kind walkers. agent_output/tool_call live in the Message
+# "message" oneof, so one WhichOneof call replaces the pair of HasField
+# probes the old HasField ladder needed per message.
+
+def _walk_append(action: Any, i: int) -> Iterator[Tuple[str, Any, int, int]]:
+    message = action.append_to_message_content.message
+    which = message.WhichOneof("message")
+    if which == "agent_output":
+        agent_output = message.agent_output
+        if agent_output.text:
+            yield ("text", agent_output.text, i, 0)
+        if agent_output.reasoning:
+            yield ("reasoning", agent_output.reasoning, i, 0)
+    elif which == "tool_call":
+        yield ("tool_call_append", message.tool_call, i, 0)
+
+
+def _walk_add_messages(action: Any, i: int) -> Iterator[Tuple[str, Any, int, int]]:
+    for j, msg in enumerate(action.add_messages_to_task.messages):
+        which = msg.WhichOneof("message")
+        if which == "agent_output":
+            if msg.agent_output.text:
+                yield ("text", msg.agent_output.text, i, j)
+        elif which == "tool_call":
+            yield ("tool_call_msg", msg.tool_call, i, j)
+
+
+def _walk_update_message(action: Any, i: int) -> Iterator[Tuple[str, Any, int, int]]:
+    umsg = action.update_task_message.message
+    if umsg.WhichOneof("message") == "agent_output" and umsg.agent_output.text:
+        yield ("text", umsg.agent_output.text, i, 0)
+
+
+def _walk_create_task(action: Any, i: int) -> Iterator[Tuple[str, Any, int, int]]:
+    # create_task messages only ever contribute text, so the whole walk
+    # collapses to one delegated generator expression: filtering and
+    # extraction run in a single frame instead of per-message loop
+    # bytecode with explicit yields.
+    yield from (
+        ("text", msg.agent_output.text, i, j)
+        for j, msg in enumerate(action.create_task.task.messages)
+        if msg.WhichOneof("message") == "agent_output" and msg.agent_output.text
+    )
+
+
+def _walk_summary(action: Any, i: int) -> Iterator[Tuple[str, Any, int, int]]:
+    summary = action.update_task_summary.summary
+    if summary:
+        yield ("text", summary, i, 0)
+
+
+_ACTION_WALKERS = {
+    "append_to_message_content": _walk_append,
+    "add_messages_to_task": _walk_add_messages,
+    "update_task_message": _walk_update_message,
+    "create_task": _walk_create_task,
+    "update_task_summary": _walk_summary,
+}
+
+
+def _iter_events(response: Any) -> Iterator[Tuple[str, Any, int, int]]:
+    """Walk a parsed ResponseEvent once, yielding tagged events.
+
+    Yields (kind, value, action_index, message_index) tuples:
+
+      ("text", str, i, j)             - a content fragment
+      ("reasoning", str, i, j)        - a reasoning fragment
+      ("tool_call_append", msg, i, 0) - tool_call from append_to_message_content
+      ("tool_call_msg", msg, i, j)    - tool_call from add_messages_to_task
+      ("finish", None, 0, 0)          - the finished marker
+
+    All extraction entry points consume this walker, so the action-loop
+    logic lives in one place and text-only consumers can skip tool-call
+    construction entirely. Each action is dispatched through one
+    WhichOneof("action") lookup instead of up to five HasField probes.
+    """
+    if response.HasField("client_actions"):
+        for i, action in enumerate(response.client_actions.actions):
+            walker = _ACTION_WALKERS.get(action.WhichOneof("action"))
+            if walker is not None:
+                yield from walker(action, i)
+    if response.HasField("finished"):
+        yield ("finish", None, 0, 0)
+
+
+# Name of the tool-kind oneof on ToolCall, discovered from the first
+# instance seen (schema introspection, not a hardcoded assumption).
+# "" means the message has no oneof and we fall back to ListFields.
+_TOOL_KIND_ONEOF: Optional[str] = None
+
+
+def _tool_call_kind(tool_call: Any) -> Tuple[Optional[str], Any]:
+    """Return (kind_name, value) for the set tool field, or (None, None)."""
+    global _TOOL_KIND_ONEOF
+    if _TOOL_KIND_ONEOF is None:
+        oneofs = tool_call.DESCRIPTOR.oneofs
+        _TOOL_KIND_ONEOF = oneofs[0].name if oneofs else ""
+    if _TOOL_KIND_ONEOF:
+        # One C-level lookup; no (FieldDescriptor, value) list allocation.
+        kind = tool_call.WhichOneof(_TOOL_KIND_ONEOF)
+        if kind is not None:
+            return kind, getattr(tool_call, kind)
+        return None, None
+    for field, value in tool_call.ListFields():
+        if field.name != 'tool_call_id':
+            return field.name, value
+    return None, None
+
+
+def _tool_call_openai(tool_call: Any, default_id: str) -> Dict[str, Any]:
+    """Build the OpenAI tool_call dict for an add_messages_to_task entry."""
+    tool_name = "unknown"
+    tool_args = "{}"
+    tool_call_id = getattr(tool_call, 'tool_call_id', default_id)
+    kind, value = _tool_call_kind(tool_call)
+    if kind is not None:
+        tool_name = kind
+        if hasattr(value, 'ListFields'):
+            tool_fields_dict = {}
+            for tool_field, tool_value in value.ListFields():
+                if isinstance(tool_value, str):
+                    tool_fields_dict[tool_field.name] = tool_value
+                elif hasattr(tool_value, '__len__'):
+                    # Repeated container: handed over as-is; the
+                    # serializer's default=list converts it lazily.
+                    tool_fields_dict[tool_field.name] = tool_value
+                else:
+                    tool_fields_dict[tool_field.name] = str(tool_value)
+            if tool_fields_dict:
+                tool_args = _dumps_args(tool_fields_dict)
+    return {
+        "id": tool_call_id,
+        "type": "function",
+        "function": {"name": tool_name, "arguments": tool_args}
+    }
+
+
+def extract_openai_content_from_response(payload: bytes, include_metadata: bool = False) -> dict:
     """
     Extract OpenAI-compatible content from Warp API response payload.
+
+    response_fields/has_client_actions metadata is diagnostic only and
+    costs an extra descriptor walk per call, so it is built only when
+    include_metadata is set.
     """
     if not payload:
         logger.debug("extract_openai_content_from_response: payload is empty")
         return {"content": None, "tool_calls": [], "finish_reason": None, "metadata": {}}
 
-    logger.debug(f"extract_openai_content_from_response: processing payload of {len(payload)} bytes")
-
-    hex_dump = payload.hex()
-    logger.debug(f"extract_openai_content_from_response: complete payload hex: {hex_dump}")
+    # Bounded hex prefix: a full payload.hex() allocates a 2N-char
+    # string, and dumps past a few hundred bytes are never read anyway.
+    # The memoryview slice avoids copying the prefix bytes first.
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("extract_openai_content_from_response: processing payload of %d bytes", len(payload))
+        logger.debug("extract_openai_content_from_response: payload hex prefix: %s (total %d bytes)",
+                     memoryview(payload)[:256].hex(), len(payload))
 
     try:
-        ensure_proto_runtime()
-        ResponseEvent = msg_cls("warp.multi_agent.v1.ResponseEvent")
-        response = ResponseEvent()
+        # Heartbeat/terminator frames carry only an empty `finished`;
+        # a two-byte compare replaces the whole parse+walk for them.
+        if payload == _empty_finished_frame():
+            return {"content": "", "tool_calls": [], "finish_reason": "stop",
+                    "metadata": {"payload_size": len(payload)}}
+
+        response = _reusable_response()
         response.ParseFromString(payload)
 
         result = {"content": "", "tool_calls": [], "finish_reason": None, "metadata": {}}
+        # Fragment lists + one join: repeated str += over many small
+        # chunks reallocates the growing string each time.
+        content_parts: List[str] = []
+        reasoning_parts: List[str] = []
+        # Bind the hot append methods to locals: LOAD_FAST per fragment
+        # instead of a subscript/attribute chain.
+        _append_content = content_parts.append
+        _append_reasoning = reasoning_parts.append
+        _append_tool = result["tool_calls"].append
 
-        if response.HasField("client_actions"):
-            for i, action in enumerate(response.client_actions.actions):
-                if action.HasField("append_to_message_content"):
-                    message = action.append_to_message_content.message
-                    if message.HasField("agent_output"):
-                        agent_output = message.agent_output
-                        if agent_output.text:
-                            result["content"] += agent_output.text
-                        if agent_output.reasoning:
-                            if "reasoning" not in result:
-                                result["reasoning"] = ""
-                            result["reasoning"] += agent_output.reasoning
-                    if message.HasField("tool_call"):
-                        tool_call = message.tool_call
-                        openai_tool_call = {
-                            "id": getattr(tool_call, 'id', f"call_{i}"),
-                            "type": "function",
-                            "function": {
-                                "name": getattr(tool_call, 'name', getattr(tool_call, 'function_name', 'unknown')),
-                                "arguments": getattr(tool_call, 'arguments', getattr(tool_call, 'parameters', '{}'))
-                            }
-                        }
-                        result["tool_calls"].append(openai_tool_call)
-                elif action.HasField("add_messages_to_task"):
-                    for j, msg in enumerate(action.add_messages_to_task.messages):
-                        if msg.HasField("agent_output") and msg.agent_output.text:
-                            result["content"] += msg.agent_output.text
-                        if msg.HasField("tool_call"):
-                            tool_call = msg.tool_call
-                            tool_name = "unknown"
-                            tool_args = "{}"
-                            tool_call_id = getattr(tool_call, 'tool_call_id', f"call_{i}_{j}")
-                            for field, value in tool_call.ListFields():
-                                if field.name == 'tool_call_id':
-                                    continue
-                                tool_name = field.name
-                                if hasattr(value, 'ListFields'):
-                                    tool_fields_dict = {}
-                                    for tool_field, tool_value in value.ListFields():
-                                        if isinstance(tool_value, str):
-                                            tool_fields_dict[tool_field.name] = tool_value
-                                        elif hasattr(tool_value, '__len__') and not isinstance(tool_value, str):
-                                            tool_fields_dict[tool_field.name] = list(tool_value)
-                                        else:
-                                            tool_fields_dict[tool_field.name] = str(tool_value)
-                                    if tool_fields_dict:
-                                        import json
-                                        tool_args = json.dumps(tool_fields_dict)
-                                break
-                            openai_tool_call = {
-                                "id": tool_call_id,
-                                "type": "function",
-                                "function": {"name": tool_name, "arguments": tool_args}
-                            }
-                            result["tool_calls"].append(openai_tool_call)
-                elif action.HasField("update_task_message"):
-                    umsg = action.update_task_message.message
-                    if umsg.HasField("agent_output") and umsg.agent_output.text:
-                        result["content"] += umsg.agent_output.text
-                elif action.HasField("create_task"):
-                    task = action.create_task.task
-                    for j, msg in enumerate(task.messages):
-                        if msg.HasField("agent_output") and msg.agent_output.text:
-                            result["content"] += msg.agent_output.text
-                elif action.HasField("update_task_summary"):
-                    summary = action.update_task_summary.summary
-                    if summary:
-                        result["content"] += summary
-        if response.HasField("finished"):
-            result["finish_reason"] = "stop"
-        result["metadata"] = {
-            "response_fields": [field.name for field, _ in response.ListFields()],
-            "has_client_actions": response.HasField("client_actions"),
-            "payload_size": len(payload)
-        }
+        for kind, value, i, j in _iter_events(response):
+            if kind == "text":
+                _append_content(value)
+            elif kind == "reasoning":
+                _append_reasoning(value)
+            elif kind == "tool_call_append":
+                tool_call = value
+                # Nested getattr defaults evaluate the fallback lookup
+                # even when the primary attribute exists; EAFP defers it
+                # to the miss path.
+                try:
+                    name = tool_call.name
+                except AttributeError:
+                    name = getattr(tool_call, 'function_name', 'unknown')
+                try:
+                    arguments = tool_call.arguments
+                except AttributeError:
+                    arguments = getattr(tool_call, 'parameters', '{}')
+                openai_tool_call = {
+                    "id": getattr(tool_call, 'id', f"call_{i}"),
+                    "type": "function",
+                    "function": {"name": name, "arguments": arguments}
+                }
+                _append_tool(openai_tool_call)
+            elif kind == "tool_call_msg":
+                _append_tool(_tool_call_openai(value, f"call_{i}_{j}"))
+            elif kind == "finish":
+                result["finish_reason"] = "stop"
+        result["content"] = "".join(content_parts)
+        if reasoning_parts:
+            result["reasoning"] = "".join(reasoning_parts)
+        if include_metadata:
+            # One descriptor walk feeds both metadata entries; HasField
+            # over the same field again would re-traverse what
+            # ListFields found.
+            response_fields = [field.name for field, _ in response.ListFields()]
+            result["metadata"] = {
+                "response_fields": response_fields,
+                "has_client_actions": "client_actions" in response_fields,
+                "payload_size": len(payload)
+            }
+        else:
+            result["metadata"] = {"payload_size": len(payload)}
         return result
     except Exception as e:
-        logger.error(f"extract_openai_content_from_response: exception occurred: {e}")
-        import traceback
-        logger.error(f"extract_openai_content_from_response: traceback: {traceback.format_exc()}")
+        # exc_info defers the stack walk and traceback rendering to the
+        # handler, so a filtered-out ERROR costs nothing.
+        logger.error("extract_openai_content_from_response: exception occurred: %s", e, exc_info=True)
         return {"content": None, "tool_calls": [], "finish_reason": "error", "metadata": {"error": str(e)}}
 
 
 def extract_text_from_response(payload: bytes) -> Optional[str]:
-    result = extract_openai_content_from_response(payload)
-    return result["content"] if result["content"] else None
+    # Text-only consumer: walks the same events but never builds
+    # tool-call dicts or metadata.
+    if not payload:
+        return None
+    try:
+        if payload == _empty_finished_frame():
+            return None
+        response = _reusable_response()
+        response.ParseFromString(payload)
+        text = "".join(v for kind, v, _i, _j in _iter_events(response) if kind == "text")
+        return text or None
+    except Exception as e:
+        logger.error("extract_text_from_response: exception occurred: %s", e)
+        return None
+
+
+def _delta(payload: Dict[str, Any], finish: Optional[str] = None) -> Dict[str, Any]:
+    """Wrap a delta payload in the OpenAI chunk scaffolding.
+
+    One place builds the choices/index/finish_reason skeleton instead of
+    each yield site repeating the three-level literal. A fresh dict per
+    event is deliberate — consumers may mutate what they receive.
+    """
+    return {"choices": [{"index": 0, "delta": payload, "finish_reason": finish}]}
 
 
-def extract_openai_sse_deltas_from_response(payload: bytes) -> List[Dict[str, Any]]:
+def extract_openai_sse_deltas_from_response(payload: bytes) -> Iterator[Dict[str, Any]]:
+    # Generator: each delta dict is yielded as it is built, so an SSE
+    # writer can forward it immediately and peak memory stays at one
+    # delta instead of the whole materialized list. Callers that need a
+    # list still get one via list(...).
     if not payload:
-        return []
+        return
     try:
-        ensure_proto_runtime()
-        ResponseEvent = msg_cls("warp.multi_agent.v1.ResponseEvent")
-        response = ResponseEvent()
+        if payload == _empty_finished_frame():
+            yield _delta({}, "stop")
+            return
+        response = _response_event_cls()()
         response.ParseFromString(payload)
-        deltas = []
-        if response.HasField("client_actions"):
-            for i, action in enumerate(response.client_actions.actions):
-                if action.HasField("append_to_message_content"):
-                    message = action.append_to_message_content.message
-                    if message.HasField("agent_output"):
-                        agent_output = message.agent_output
-                        if agent_output.text:
-                            deltas.append({"choices": [{"index": 0, "delta": {"content": agent_output.text}, "finish_reason": None}]})
-                        if agent_output.reasoning:
-                            deltas.append({"choices": [{"index": 0, "delta": {"reasoning": agent_output.reasoning}, "finish_reason": None}]})
-                    if message.HasField("tool_call"):
-                        tool_call = message.tool_call
-                        deltas.append({"choices": [{"index": 0, "delta": {"role": "assistant"}, "finish_reason": None}]})
-                        openai_tool_call = {
-                            "id": getattr(tool_call, 'tool_call_id', f"call_{i}"),
-                            "type": "function",
-                            "function": {
-                                "name": getattr(tool_call, 'name', 'unknown'),
-                                "arguments": getattr(tool_call, 'arguments', '{}')
-                            }
-                        }
-                        deltas.append({"choices": [{"index": 0, "delta": {"tool_calls": [openai_tool_call]}, "finish_reason": None}]})
-                elif action.HasField("add_messages_to_task"):
-                    for j, msg in enumerate(action.add_messages_to_task.messages):
-                        if msg.HasField("agent_output") and msg.agent_output.text:
-                            deltas.append({"choices": [{"index": 0, "delta": {"content": msg.agent_output.text}, "finish_reason": None}]})
-                        if msg.HasField("tool_call"):
-                            tool_call = msg.tool_call
-                            if j == 0:
-                                deltas.append({"choices": [{"index": 0, "delta": {"role": "assistant"}, "finish_reason": None}]})
-                            tool_call_id = getattr(tool_call, 'tool_call_id', f"call_{i}_{j}")
-                            tool_name = "unknown"
-                            tool_args = "{}"
-                            for field, value in tool_call.ListFields():
-                                if field.name == 'tool_call_id':
-                                    continue
-                                tool_name = field.name
-                                if hasattr(value, 'ListFields'):
-                                    tool_fields_dict = {}
-                                    for tool_field, tool_value in value.ListFields():
-                                        if isinstance(tool_value, str):
-                                            tool_fields_dict[tool_field.name] = tool_value
-                                        elif hasattr(tool_value, '__len__') and not isinstance(tool_value, str):
-                                            tool_fields_dict[tool_field.name] = list(tool_value)
-                                        else:
-                                            tool_fields_dict[tool_field.name] = str(tool_value)
-                                    if tool_fields_dict:
-                                        import json
-                                        tool_args = json.dumps(tool_fields_dict)
-                                break
-                            openai_tool_call = {"id": tool_call_id, "type": "function", "function": {"name": tool_name, "arguments": tool_args}}
-                            deltas.append({"choices": [{"index": 0, "delta": {"tool_calls": [openai_tool_call]}, "finish_reason": None}]})
-                elif action.HasField("update_task_message"):
-                    umsg = action.update_task_message.message
-                    if umsg.HasField("agent_output") and umsg.agent_output.text:
-                        deltas.append({"choices": [{"index": 0, "delta": {"content": umsg.agent_output.text}, "finish_reason": None}]})
-                elif action.HasField("create_task"):
-                    task = action.create_task.task
-                    for j, msg in enumerate(task.messages):
-                        if msg.HasField("agent_output") and msg.agent_output.text:
-                            deltas.append({"choices": [{"index": 0, "delta": {"content": msg.agent_output.text}, "finish_reason": None}]})
-                elif action.HasField("update_task_summary"):
-                    summary = action.update_task_summary.summary
-                    if summary:
-                        deltas.append({"choices": [{"index": 0, "delta": {"content": summary}, "finish_reason": None}]})
-        if response.HasField("finished"):
-            deltas.append({"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
-        return deltas
+        for kind, value, i, j in _iter_events(response):
+            if kind == "text":
+                yield _delta({"content": value})
+            elif kind == "reasoning":
+                yield _delta({"reasoning": value})
+            elif kind == "tool_call_append":
+                tool_call = value
+                yield _delta({"role": "assistant"})
+                openai_tool_call = {
+                    "id": getattr(tool_call, 'tool_call_id', f"call_{i}"),
+                    "type": "function",
+                    "function": {
+                        "name": getattr(tool_call, 'name', 'unknown'),
+                        "arguments": getattr(tool_call, 'arguments', '{}')
+                    }
+                }
+                yield _delta({"tool_calls": [openai_tool_call]})
+            elif kind == "tool_call_msg":
+                if j == 0:
+                    yield _delta({"role": "assistant"})
+                openai_tool_call = _tool_call_openai(value, f"call_{i}_{j}")
+                yield _delta({"tool_calls": [openai_tool_call]})
+            elif kind == "finish":
+                yield _delta({}, "stop")
     except Exception as e:
-        logger.error(f"extract_openai_sse_deltas_from_response: exception occurred: {e}")
-        import traceback
-        logger.error(f"extract_openai_sse_deltas_from_response: traceback: {traceback.format_exc()}")
-        return [] 
\ No newline at end of file
+        logger.error("extract_openai_sse_deltas_from_response: exception occurred: %s", e, exc_info=True)
+        return